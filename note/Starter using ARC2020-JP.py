@@ -6,15 +6,14 @@
 #
 # ## 機能
 # このノートブックには以下の機能があります：
-# - 古いCSV形式から、ARC Prize 2024に必要な新しいJSON形式への提出の変換。
 # - オブジェクト検出や操作など様々なテクニックを使ったARCタスクの解答予測。
-# - コンペティションのガイドラインに沿った提出用CSVファイルの生成。
+# - タスクを解きながら、コンペティションのガイドラインに沿った`submission.json`ファイルを書き出します。
 #
 # ## ガイドライン
 # このノートブックを効果的に使うために:
 # 1. **データの準備**:
 #    - 必要なJSONファイル（`arc-agi_test_challenges.json`）が指定のディレクトリ（`/kaggle/input/arc-prize-2024/`）にあることを確認してください。
-#    - スクリプトは自動的に個別のタスクJSONファイルを保存するための`test`ディレクトリを作成します。
+#    - タスクは結合されたJSONファイルから直接読み込まれ、タスクごとのファイルは書き出されません。
 #
 # **🌟 私のプロファイルや他の公開プロジェクトを見て、フィードバックをシェアするのを忘れないでください!**
 #
@@ -24,16 +23,17 @@
 # 2. **提出プロセス**:
 #    - 入力タスクに基づいて解答を予測する`predict_part_types`関数を実装・改良してください。
 #    - オブジェクト検出（`get_objects_by_connectivity_`、`get_objects_by_color_`）などの手法を活用して予測を生成してください。
-#    - 予測が提出用CSV（`sample_submission.csv`）に正しくフォーマットされていることを確認してください。
+#    - 予測は各テスト入力の`attempt_1`/`attempt_2`として`submission.json`に直接書き込まれます。
 #
 # 3. **実行**:
 #    - `main()`関数を実行して提出プロセスを開始してください。
 #    - 生成された`submission.json`ファイルをレビューして、提出の形式と内容を確認してください。
 #
 # ## 動作詳細
-# - **データの読み込み**: JSONファイルが読み込まれ、処理のために個別のタスクファイルに分割されます。
+# - **データの読み込み**: 結合されたチャレンジJSONファイルを一度だけ読み込み、`load_tasks`でタスクを1つずつ作成します。
 # - **予測**: タスクは、検出されたオブジェクトとその属性に基づいて予測を生成するために`predict_part_types`のような関数を使って分析されます。
-# - **提出**: 予測はCSVファイル（`old_submission.csv`）にまとめられ、`translate_submission`関数を使って必要なJSON形式に変換されます。
+# - **提出**: 各タスクの予測と解くのにかかった時間は、タスクが解かれるとすぐにジャーナル（`submission_journal.jsonl`）に追記され、最後にジャーナルから必要なJSON形式（`submission.json`）が組み立てられます。中間のCSVファイルは使いません。途中で中断された実行は`submit(predict_part_types, resume=True)`で続行でき、ジャーナルにあるタスクはスキップされます。
+# - **パイプライン**: 読み込み、解答、書き込みはパイプライン（`run_pipeline`）として実行されます。ローダースレッドが現在のタスクを解いている間に次のタスクを解析し、ライタースレッドが結果をタスクの順序でジャーナルに記録します。ステージ間のキューには上限があるため、メモリに保持されるタスクは数個だけで、最後に各ステージの使用率が表示されます。
 #
 #
 # ## 謝辞 🙏
@@ -47,10 +47,7 @@
 # 📚 必要なライブラリのインポート 📊
 
 import os  # OSに関連する操作用
-import json  # JSON操作用
-import csv  # CSVファイル操作用
 import numpy as np  # NumPyは数値計算用
-import pandas as pd  # Pandasはデータ操作用
 from pathlib import Path  # Pathlibはパス操作用
 import sys
 
@@ -62,9 +59,15 @@ else:
 
 # arclibから特定の関数とクラスをインポート 📦
 from arclib.dsl import *
-from arclib.util import evaluate_predict_func, get_string, data_path
+from arclib.util import evaluate_predict_func, get_string, data_path, load_tasks
 from arclib.dsl import Task, unique_arrays  
 from arclib.check import check_output_color_from_input
+from arclib.cache import grid_cache
+from arclib.budget import Budget
+from arclib.features import ObjectTable, learn_selectors, rank_selected_rows
+from arclib.trace import tracer, traced, span
+from arclib.submission import SubmissionJournal
+from arclib.pipeline import run_pipeline, print_pipeline_stats, worker_died
 
 
 # %% [markdown]
@@ -74,222 +77,29 @@ from arclib.check import check_output_color_from_input
 # %% [markdown]
 # ### 概要
 #
-# このスクリプトは、指定されたファイルからJSONコンテンツを読み込み、'test'という名前のディレクトリが存在しない場合は作成し、読み込まれたJSONコンテンツを個別のファイルに分割します。JSONデータの各タスクは、'test'ディレクトリ内の個別のJSONファイルとして保存されます。
+# このセルは、すべてのテストタスクを含む結合されたJSONファイルを指定します。タスクは個別のファイルに分割されません。`arclib.util`の`load_tasks`がファイルを一度だけ読み込み、そこから直接`Task`オブジェクトを作成します。
 #
 # ### ステップと機能
 #
-# 1. **JSONコンテンツの読み込み**
-#    - `json_file_path`で指定されたファイルからJSONデータを開いて読み込みます。
-#    - 読み込まれたJSONデータを`data`変数に格納して、さらに処理します。
+# 1. **JSONコンテンツの指定**
+#    - `test_challenges_path`は、すべてのテストタスクを含む結合ファイル（`{task_id: task}`）です。
 #
-# 2. **出力ディレクトリの作成**
-#    - 個別のJSONファイルが保存されるパスを`output_dir`として定義します（デフォルトでは`'/kaggle/working/test'`）。
-#    - `os.makedirs(output_dir, exist_ok=True)`を使用して、ディレクトリが存在しない場合は作成します（`exist_ok=True`により、ディレクトリが既に存在する場合にエラーが発生しないようにします）。
-#
-# 3. **JSONコンテンツの分割**
-#    - 読み込まれたJSONデータ（`data.items()`）の各`task_id`と`task_data`のペアを反復処理します。
-#    - `os.path.join(output_dir, f'{task_id}.json')`を使用して、各タスクの出力ファイルパスを構築します。
-#    - 各出力ファイルを書き込みモード（`'w'`）で開き、対応する`task_data`を`json.dump(task_data, output_file, indent=4)`を使用してファイルに書き込み、可読性を向上させます。
-#
-# ### 使用方法
-#
-# - `json_file_path`が、JSONデータの正しい場所とファイル名を指していることを確認してください（この場合は`arc-agi_test_challenges.json`）。
-# - スクリプトは、作業ディレクトリ（`/kaggle/working/`）に'test'という名前のディレクトリを作成し、JSONデータの各タスクを、そのディレクトリ内の個別のJSONファイルとして保存します。
-# - このアプローチは、元々1つのJSONファイルに保存されている個々のタスクやデータセットを整理して管理するのに役立ちます。
-#
-# ---
-#
-
-# %% [code]
-# JSONコンテンツを読み込む
-json_file_path = '/kaggle/input/arc-prize-2024/arc-agi_test_challenges.json'  # 🌐 実際のJSONファイルのパスに置き換えてください
-with open(json_file_path, 'r') as file:
-    data = json.load(file)
-
-# 'test'ディレクトリを作成する
-output_dir = '/kaggle/working/test'  # 📁 必要に応じてこのパスを変更できます
-os.makedirs(output_dir, exist_ok=True)
-
-# JSONコンテンツを個別のファイルに分割する
-for task_id, task_data in data.items():
-    output_file_path = os.path.join(output_dir, f'{task_id}.json')
-    with open(output_file_path, 'w') as output_file:
-        json.dump(task_data, output_file, indent=4)
-
-
-# %% [markdown]
-# # 📄 JSONコンテンツの読み込み
-#
-
-# %% [markdown]
-# ### 概要
-#
-# このスクリプトは、提出データを含むJSONファイルを読み込み、各エントリを指定されたCSV形式に変換し、CSVファイルに書き込みます。CSVファイルは、`output_id`と`output`の2つの列で構成されています。ここで、`output`はJSONデータから派生したもので、2次元の行列をCSVに適した文字列形式に変換したものです。
-#
-# ### ステップと機能
-#
-# 1. **JSONデータの読み込み**
-#    - スクリプトは、`json_file_path`で指定されたJSONファイルを開いて読み込むことから始まります。
-#
-# 2. **出力CSVファイルの定義**
-#    - 変換されたデータが保存されるCSVファイルの出力パスを`output_csv_path`で定義します。
-#
-# 3. **2次元リストのCSV文字列形式への変換**
-#    - 2次元リスト（行列）をCSVに適した文字列形式に変換する`convert_to_csv_format(matrix)`関数を定義します。各行の要素を'|'で結合し、'|'記号で囲みます。
-#
-# 4. **CSVファイルへの書き込み**
-#    - `output_csv_path`を書き込みモード（`'w'`）で開き、CSVファイルにデータを書き込むための`csv.DictWriter`インスタンスを初期化します。
-#    - `writer.writeheader()`を使用してヘッダー行（`'output_id', 'output'`）を書き込みます。
-#
-# 5. **各タスクの処理**
-#    - 読み込まれたJSONデータ（`data.items()`）の各`task_id`と関連する`attempts`を反復処理します。
-#    - 試行が1回だけの場合（`len(attempts) == 1`）、次の処理を行います。
-#      - `output_id`を`{task_id}_0`の形式でフォーマットします。
-#      - `convert_to_csv_format`を使用して、`attempt['attempt_1']`と`attempt['attempt_2']`をCSV形式に変換します。
-#      - 両方の試行を`combined_output`に結合し、CSVファイルに書き込みます。
-#    - 複数の試行がある場合は、各試行（`enumerate(attempts)`）を反復処理し、`output_id`をそれに応じてフォーマットします。
-#
-# 6. **完了メッセージ**
-#    - 変換プロセスが正常に完了したことを示す完了メッセージ（`"✅ Sample submission CSV file created at {output_csv_path}"`）を表示します。
-#
-# ### 使用方法
-#
-# - `json_file_path`が、入力JSONファイル（この場合は`sample_submission.json`）の正しい場所とファイル名を指していることを確認してください。
-# - 実行後、`sample_submission.csv`には、提出に適した指定の形式で処理された提出データが含まれます。
-#
-# ---
-#
-
-# %% [code]
-json_file_path = '/kaggle/input/arc-prize-2024/sample_submission.json'
-
-with open(json_file_path, 'r') as file:
-    data = json.load(file)
-
-# 出力CSVファイルのパスを定義する
-output_csv_path = '/kaggle/working/sample_submission.csv'
-
-# 2次元リストを必要な文字列形式に変換する関数
-def convert_to_csv_format(matrix):
-    return '|' + '|'.join(''.join(map(str, row)) for row in matrix) + '|'
-
-# CSVファイルに処理して書き込む
-with open(output_csv_path, 'w', newline='') as csvfile:
-    fieldnames = ['output_id', 'output']
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    writer.writeheader()
-
-    for task_id, attempts in data.items():
-        if len(attempts) == 1:
-            attempt = attempts[0]
-            output_id = f"{task_id}_0"
-            attempt_1 = convert_to_csv_format(attempt['attempt_1'])
-            attempt_2 = convert_to_csv_format(attempt['attempt_2'])
-            combined_output = f"{attempt_1} {attempt_2}"
-            writer.writerow({'output_id': output_id, 'output': combined_output})
-        else:
-            for i, attempt in enumerate(attempts):
-                output_id = f"{task_id}_{i}"
-                attempt_1 = convert_to_csv_format(attempt['attempt_1'])
-                attempt_2 = convert_to_csv_format(attempt['attempt_2'])
-                combined_output = f"{attempt_1} {attempt_2}"
-                writer.writerow({'output_id': output_id, 'output': combined_output})
-
-print(f"✅ サンプル提出用CSVファイルが{output_csv_path}に作成されました")
-
-
-# %% [markdown]
-# # 🔄 CSVからJSONに変換する関数
-#
-
-# %% [markdown]
-#
-# ### 概要
-#
-# この関数は、CSVファイルに保存されている古い提出形式を、ARC Prize 2024 コンペティションに必要な新しいJSON形式に変換します。CSVの各行を処理し、関連情報を抽出し、提出に適したJSON形式に構造化します。
-#
-# ### ステップと機能
-#
-# 1. **CSVファイルの読み込みと解析**
-#    - 関数は、`file_path`で指定されたCSVファイルを開いて読み込むことから始まります。
-#    - ヘッダー行を除く全ての行（`lines[1:]`）を読み込み、ヘッダー情報をスキップします。
-#
-# 2. **各行の処理**
-#    - CSVファイルの各行について:
-#      - `,`で行を分割して、`output_id`と`output`を抽出します。
-#      - タスクと試行のインデックスを特定するために、`output_id`を`task_id`と`output_idx`に分割します。
-#      - スペース`' '`に基づいて`output`を分割して、個々の予測を取得します。
-#      - 2つ以上の予測がある場合は、最初の2つの予測のみを考慮します。
-#      - 各予測を、'|'で区切られた文字列行（`pred_lines`）から整数を解析してマッピングすることにより、行列形式（`pred_matrix`）に変換します。
-#
-# 3. **試行の整理**
-#    - 各試行（`attempt_dict`）を、`"attempt_1"`と`"attempt_2"`のキーが最初と2番目の試行の行列をそれぞれ表す辞書として構造化します。
-#    - 試行を`submission_dict`の対応する`task_id`の下に挿入します。最初の試行（`output_idx == '0'`）の場合は先頭に挿入し（`insert(0, ...)`）、それ以外の場合は追加します。
-#
-# 4. **JSONファイルへの書き込み**
-#    - 最後に、構造化された`submission_dict`を`'submission.json'`という名前の新しいJSONファイルに書き込みます。
-#    - 可読性のために`indent=4`を使用して`json.dump()`を呼び出し、JSONにインデントを付けてフォーマットします。
-#    
-# 5. **確認メッセージ**
-#    - 変換プロセスが正常に完了したことを示す確認メッセージ（`"✅ 変換された提出が 'submission.json' として保存されました"`）を表示します。
+# 2. **タスクの読み込み**
+#    - `load_tasks(path)`は、結合ファイルとタスクごとに1つのJSONファイルを含むディレクトリの両方を受け付けます。
+#    - `load_tasks(path, solutions_path)`は、結合された解答ファイルからテスト出力を追加します。
+#    - `load_tasks(path, lazy=True)`は、タスクを1つずつ解析するジェネレータを返すため、すべてのタスクの解析済みJSONとNumPyのコピーを同時に保持することはありません。
+#    - 各タスクには`task_id`が付与され、提出の`output_id`に使用されます。
 #
 # ### 使用方法
 #
-# - CSVファイル（`file_path`）が、関数が期待する正しい形式になっていることを確認してください。
-# - 実行後、`'submission.json'`には、ARC Prize 2024 コンペティションに提出できる、変換された提出データが含まれます。
+# - `test_challenges_path`が、JSONデータの正しい場所とファイル名を指していることを確認してください（この場合は`arc-agi_test_challenges.json`）。
 #
 # ---
 #
-#
 
 # %% [code]
-# 🔄 古い提出形式（csv）から新しい形式（json）に変換する関数
-
-def translate_submission(file_path):
-    # 元の提出ファイルを読み込む
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    submission_dict = {}
-
-    for line in lines[1:]:  # ヘッダー行をスキップする
-        output_id, output = line.strip().split(',')
-        task_id, output_idx = output_id.split('_')
-        predictions = output.split(' ')  # ' 'に基づいて予測を分割する
-        
-        # 最初の2つの予測のみを取る
-        if len(predictions) > 2:
-            predictions = predictions[:2]
-
-        processed_predictions = []
-        for pred in predictions:
-            if pred:  # predが空の文字列でないことを確認する
-                pred_lines = pred.split('|')[1:-1]  # 分割から空の文字列を削除する
-                pred_matrix = [list(map(int, line)) for line in pred_lines]
-                processed_predictions.append(pred_matrix)
-
-        attempt_1 = processed_predictions[0] if len(processed_predictions) > 0 else []  # 試行1の行列
-        attempt_2 = processed_predictions[1] if len(processed_predictions) > 1 else []  # 試行2の行列
-
-        if task_id not in submission_dict:
-            submission_dict[task_id] = []
-
-        attempt_dict = {
-            "attempt_1": attempt_1,
-            "attempt_2": attempt_2
-        }
-
-        if output_idx == '0':
-            submission_dict[task_id].insert(0, attempt_dict)  # 最初の試行を挿入する
-        else:
-            submission_dict[task_id].append(attempt_dict)  # 後続の試行を追加する
-    
-    # 新しいJSONファイルに書き込む
-    with open('submission.json', 'w') as file:
-        json.dump(submission_dict, file, indent=4)  # 可読性のためにインデントを付けてJSONを保存する
-
-    print(f"✅ 変換された提出が 'submission.json' として保存されました")  # 変換成功後の確認メッセージ
-
+# すべてのテストタスクを含む結合JSONファイル。`submit`内の`load_tasks`で読み込まれます
+test_challenges_path = '/kaggle/input/arc-prize-2024/arc-agi_test_challenges.json'  # 🌐 実際のJSONファイルのパスに置き換えてください
 
 
 # %% [markdown]
@@ -303,13 +113,10 @@ def translate_submission(file_path):
 #
 # ```python
 # data_path = Path('/kaggle/working/')  # 📁 作業ディレクトリへのパス
-# test_path = data_path / 'test'         # 📁 テストディレクトリへのパス
-# sample_submission_path = '/kaggle/working/sample_submission.csv'  # 📄 サンプル提出CSVへのパス
 # ```
 #
 # - **説明**: 
-#   - `data_path`と`test_path`: 入力データ（タスク）とテストファイルがそれぞれ保存されるディレクトリを定義します。
-#   - `sample_submission_path`: 予測がフォーマットされ、書き込まれるサンプル提出CSVファイルを指します。
+#   - `data_path`: 作業ディレクトリを定義します。テストタスクは上で定義した`test_challenges_path`から読み込まれます。
 #
 # #### 2. 候補に対する出力のチェック
 #
@@ -318,13 +125,7 @@ def translate_submission(file_path):
 #     """
 #     与えられた出力が候補出力のいずれかと一致するかどうかを確認します。
 #     """
-#     output_is_candidate = False
-#
-#     for candidate in candidates:
-#         if output.shape == candidate.shape:
-#             if (output == candidate).all():
-#                 output_is_candidate = True
-#                 break
+#     output_is_candidate = contains_array(candidates, output)
 #     return output_is_candidate
 # ```
 #
@@ -373,60 +174,52 @@ def translate_submission(file_path):
 # #### 6. 提出と結果の処理
 #
 # ```python
-# def submit(predict):
+# def submit(predict, journal_path='submission_journal.jsonl', resume=False, n_jobs=1):
 #     """
-#     テストタスクの予測を提出し、新しい提出CSVファイルを作成します。
+#     テストタスクの予測を提出し、タスクごとにジャーナルに記録してsubmission.jsonを書き込みます。
 #     """
 #     # 上記のコードで説明されている実装の詳細...
 # ```
 #
 # - **説明**: 
-#   - `submit`: テストタスクを読み込み、`predict`を使用して出力を予測し、コンペティションの要件に従ってフォーマットし、`old_submission.csv`に出力します。これは、`translate_submission`を使用して最終的な提出形式に変換されます。
+#   - `submit`: ローダースレッドでテストタスクを読み込み、`predict`を使用して出力を予測し（`n_jobs > 1`の場合はプロセスプールで）、ライタースレッドが各テスト入力の最初の2つの予測を`attempt_1`と`attempt_2`として、解くのにかかった時間と一緒にジャーナル`SubmissionJournal`に追記します。`resume=True`の場合、ジャーナルにあるタスクは再び解かれません。単独で解き直してもワーカープロセスを終了させるタスクはジャーナルに記録されず、再開した実行で再び試されます。キャッシュの統計とトレースファイル（`ARCLIB_TRACE=1`）は`n_jobs=1`の場合のみ収集されます。それ以外の場合、ソルバーのカウンタはワーカープロセスに残るためです。最後にテストタスクの順序でジャーナルから`submission.json`を組み立てます。
 #
 # ### 実行の流れ
 #
 # - **メイン実行**: スクリプトが実行されると、`main()`関数が呼び出され、それが`submit(predict_part_types)`を呼び出します。
 # - **提出プロセス**: 
-#   - サンプル提出CSVを読み込みます。
-#   - テストファイルを反復処理し、`predict_part_types`を使用して出力を予測します。
-#   - 予測をフォーマットし、`old_submission.csv`に保存します。
-#   - CSV提出を、ARC Prize 2024に必要なJSON形式に変換します。
+#   - ジャーナル`submission_journal.jsonl`を開きます（`resume=True`の場合はそのまま使い、それ以外の場合は新しく始めます）。
+#   - ローダースレッドで`load_tasks`を使ってテストタスクを読み込み（ジャーナルにあるタスクはスキップ）、その間に`predict_part_types`が先に読み込まれたタスクの出力を予測します。
+#   - 各タスクの予測と時間を、解き終わった直後にライタースレッドでジャーナルに追記します。
+#   - ジャーナルからARC Prize 2024に必要なJSON形式の`submission.json`を組み立てます。予測のないタスクは空のattemptになります。
 #
 #
 #
 
 # %% [code]
-# 📂 上記で作成したARC Prize JSONsからファイルとサンプル提出CSVへのポインタを追加する
+# 📂 作業ディレクトリへのポインタを追加する
 
 data_path = Path('/kaggle/working/')  # 📁 作業ディレクトリへのパス
-test_path = data_path / 'test'  # 📁 テストディレクトリへのパス
-
-sample_submission_path = '/kaggle/working/sample_submission.csv'  # 📄 サンプル提出CSVへのパス
 
 # 出力が候補のいずれかと一致するかどうかを確認する関数
+@traced(category='solver')
 def check_output_in_candidates(output, candidates):
     """
     与えられた出力が候補出力のいずれかと一致するかどうかを確認します。
 
     Args:
     - output (numpy.ndarray): 比較する出力行列。
-    - candidates (numpy.ndarrayのリスト): 比較する候補行列のリスト。
+    - candidates (numpy.ndarrayのリストまたはArraySet): 比較する候補行列。出力と同じ形状のものだけが比較されます。
 
     Returns:
     - output_is_candidate (bool): 出力が候補のいずれかと一致する場合はTrue、そうでない場合はFalse。
     """
-    output_is_candidate = False
-
-    for candidate in candidates:
-        if output.shape == candidate.shape:
-            if (output == candidate).all():
-                output_is_candidate = True
-                break
+    output_is_candidate = contains_array(candidates, output)
     return output_is_candidate
 
 
 # タスクの入力と候補に基づいて予測する関数
-def predict_part(task, get_candidates, train_object_maps=None, train_bg_colors=None):
+def predict_part(task, get_candidates, train_object_maps=None, train_bg_colors=None, budget=None):
     """
     候補生成を使用して、入力-出力ペアに基づいてタスクの解を予測します。
 
@@ -435,6 +228,10 @@ def predict_part(task, get_candidates, train_object_maps=None, train_bg_colors=N
     - get_candidates (function): 入力とオブジェクトマップに基づいて候補を生成する関数。
     - train_object_maps (numpy.ndarrayのリスト, optional): トレーニング入力のオブジェクトマップ。
     - train_bg_colors (list, optional): トレーニング入力の背景色。
+    - budget (Budget, optional): 探索の時間/ステップ予算。タスクが解けなかった場合は、解けたトレーニングペアの数を記録します。
+
+    トレーニングペアの候補は期待される出力のシグネチャ（形状、色ごとの画素数）と一緒に生成されるため、一致しえない候補は作られません。
+    すべてのトレーニングペアが解けた場合は、すべてのトレーニングペアで正しいオブジェクトを選ぶセレクタ（例：「最大のオブジェクト」）を学習し、その選択をテスト予測の先頭に置きます。
 
     Returns:
     - all_input_predictions (list): タスクが完全に解ける場合は各テスト入力の予測のリスト、そうでない場合は空のリスト。
@@ -444,7 +241,7 @@ def predict_part(task, get_candidates, train_object_maps=None, train_bg_colors=N
         input = np.array(input)
         output = np.array(output)
 
-        candidates = get_candidates(input, object_maps=train_object_maps[i], bg_color=train_bg_colors[i])
+        candidates = get_candidates(input, object_maps=train_object_maps[i], bg_color=train_bg_colors[i], budget=budget, target=get_signature(output))
 
         if candidates:
             if not check_output_in_candidates(output, candidates):
@@ -456,16 +253,82 @@ def predict_part(task, get_candidates, train_object_maps=None, train_bg_colors=N
 
     all_input_predictions = []
     if part_task:
-        for input in task.test_inputs:
-            test_candidates = get_candidates(input)
-            predictions = test_candidates
-            predictions = unique_arrays(predictions)
-            predictions = sorted(predictions, key=lambda x: x.shape[0] * x.shape[1], reverse=True)
-            all_input_predictions.append(predictions)
+        selectors = None
+        if train_object_maps is not None:
+            selectors = learn_object_selectors(task, get_candidates, train_object_maps, train_bg_colors)
+        all_input_predictions = predict_test_inputs(task, get_candidates, selectors=selectors)
+    elif budget is not None:
+        budget.record_partial(i, get_candidates)
 
-    else:
-        all_input_predictions = []
+    return all_input_predictions
 
+
+# すべてのトレーニングペアで正しいオブジェクトを選ぶセレクタを学習する関数
+def learn_object_selectors(task, get_candidates, train_object_maps, train_bg_colors):
+    """
+    すべてのトレーニングペアでトレーニング出力を与えるオブジェクトを選ぶ特徴量の述語（最大値・最小値、または値がただ一つのオブジェクト。`arclib.features`を参照）を求めます。
+
+    Args:
+    - task (Task): 入力-出力ペアを含むタスクオブジェクト。
+    - get_candidates (function): すべてのトレーニングペアを解いた候補生成関数。
+    - train_object_maps (numpy.ndarrayのリスト): トレーニング入力のオブジェクトマップ。
+    - train_bg_colors (list): トレーニング入力の背景色。
+
+    Returns:
+    - selectors (list): 学習したセレクタ（(how, 特徴量名)のタプル）。
+    """
+    objects_list = []
+    correct = []
+    for input_, output, object_maps, bg_color in zip(task.inputs, task.outputs, train_object_maps, train_bg_colors):
+        object_maps = [object_map for object_map in object_maps if np.count_nonzero(object_map) > 0]
+        objects_list.append(make_objects(input_, object_maps))
+        for object_map in object_maps:
+            candidates = get_candidates(input_, object_maps=[object_map], bg_color=bg_color)
+            correct.append(len(candidates) > 0 and np.array_equal(candidates[0], output))
+    return learn_selectors(ObjectTable(objects_list), np.array(correct, dtype=bool))
+
+
+# オブジェクトセレクタが選んだ候補を取得する関数
+def get_selected_candidates(input_, get_candidates, selectors):
+    """
+    学習したオブジェクトセレクタをテスト入力に適用します。
+
+    Args:
+    - input_ (numpy.ndarray): テスト入力。
+    - get_candidates (function): 候補生成関数（`get_cropped_objects`または`get_inputs_with_one_object`のpartial）。
+    - selectors (list): `learn_object_selectors`のセレクタ。
+
+    Returns:
+    - candidates (numpy.ndarrayのリスト): 選ばれたオブジェクトの候補（最も多くのセレクタが選んだものが先頭）。
+    """
+    object_maps = get_candidates.keywords['get_object_maps'](input_)
+    object_maps = [object_map for object_map in object_maps if np.count_nonzero(object_map) > 0]
+    table = ObjectTable([make_objects(input_, object_maps)])
+    return [get_candidates(input_, object_maps=[object_maps[row]])[0] for row in rank_selected_rows(table, selectors)]
+
+
+# トレーニングペアを解いた候補生成関数でテスト入力を予測する関数
+def predict_test_inputs(task, get_candidates, selectors=None):
+    """
+    タスクの各テスト入力について予測を生成します。
+
+    Args:
+    - task (Task): テスト入力を含むタスクオブジェクト。
+    - get_candidates (function): 入力に基づいて候補を生成する関数。
+    - selectors (list, optional): トレーニングペアで学習したオブジェクトセレクタ。選ばれた候補が先頭になります。
+
+    Returns:
+    - all_input_predictions (list): 各テスト入力の重複のない候補のリスト（選ばれた候補が先、その後は大きい順）。
+    """
+    all_input_predictions = []
+    for input in task.test_inputs:
+        test_candidates = get_candidates(input)
+        predictions = test_candidates
+        predictions = unique_arrays(predictions)
+        predictions = sorted(predictions, key=lambda x: x.shape[0] * x.shape[1], reverse=True)
+        if selectors:
+            predictions = unique_arrays(get_selected_candidates(input, get_candidates, selectors) + predictions)
+        all_input_predictions.append(predictions)
     return all_input_predictions
 
 
@@ -507,8 +370,31 @@ def keep_one_object(array, object_map, bg_color=None):
     return output_
 
 
+# keep_one_objectの出力を作らずに色ごとの画素数を数える関数
+def get_one_object_color_counts(array, object_map, bg_color=None):
+    """
+    keep_one_objectが返す配列の色ごとの画素数を数えます。
+
+    Args:
+    - array (numpy.ndarray): 複数のオブジェクトを含む入力配列。
+    - object_map (numpy.ndarray): 保持するオブジェクトの位置を示すバイナリマップ。
+    - bg_color (int or float, optional): オブジェクトの境界の外側を埋める背景色。
+
+    Returns:
+    - color_counts (numpy.ndarray or None): 色0..9ごとの画素数。計算できない場合はNone。
+    """
+    if bg_color is None:
+        bg_color = detect_bg_(array)
+    cropped_object = get_cropped_object(array, object_map)
+    color_counts = get_color_counts(cropped_object)
+    if color_counts is None or not 0 <= bg_color <= 9:
+        return None
+    color_counts[bg_color] += array.size - cropped_object.size
+    return color_counts
+
+
 # オブジェクトマップに基づいてクロップされたオブジェクトを取得する関数
-def get_cropped_objects(array, get_object_maps=None, object_maps=None, augment=None, bg_color=None):
+def get_cropped_objects(array, get_object_maps=None, object_maps=None, augment=None, bg_color=None, budget=None, target=None):
     """
     検出されたオブジェクトマップに基づいて、入力配列からクロップされたオブジェクトを取得します。
 
@@ -518,18 +404,27 @@ def get_cropped_objects(array, get_object_maps=None, object_maps=None, augment=N
     - object_maps (numpy.ndarrayのリスト, optional): 事前に検出されたオブジェクトマップ。
     - augment (function, optional): クロップされたオブジェクトに適用する拡張関数。
     - bg_color (int or float, optional): オブジェクトの境界の外側を埋める背景色。
+    - budget (Budget, optional): 時間/ステップ予算。オブジェクトごとに1ステップ消費し、使い切った後のオブジェクトはスキップします。
+    - target (tuple, optional): 期待される出力のシグネチャ（形状、色ごとの画素数）。それを生成できないオブジェクトはスキップします。
 
     Returns:
     - objects (numpy.ndarrayのリスト): 入力配列から抽出されたクロップされたオブジェクトのリスト。
     """
     if object_maps is None:
         object_maps = get_object_maps(array)
-    objects = [augment(get_cropped_object(array, object_map)) for object_map in object_maps if np.count_nonzero(object_map) > 0]
+    objects = []
+    for object_map in object_maps:
+        if budget is not None and not budget.step():
+            break
+        if np.count_nonzero(object_map) > 0:
+            cropped_object = get_cropped_object(array, object_map)
+            if target is None or signature_can_match(target, cropped_object.shape, get_color_counts(cropped_object), augment):
+                objects.append(augment(cropped_object))
     return objects
 
 
 # オブジェクトマップに基づいて1つのオブジェクトを含む入力を取得する関数
-def get_inputs_with_one_object(array, get_object_maps=None, object_maps=None, augment=None, bg_color=None):
+def get_inputs_with_one_object(array, get_object_maps=None, object_maps=None, augment=None, bg_color=None, budget=None, target=None):
     """
     検出されたオブジェクトマップに基づいて、正確に1つのオブジェクトを含む入力を取得します。
 
@@ -539,13 +434,21 @@ def get_inputs_with_one_object(array, get_object_maps=None, object_maps=None, au
     - object_maps (numpy.ndarrayのリスト, optional): 事前に検出されたオブジェクトマップ。
     - augment (function, optional): 保持されたオブジェクトに適用する拡張関数。
     - bg_color (int or float, optional): オブジェクトの境界の外側を埋める背景色。
+    - budget (Budget, optional): 時間/ステップ予算。オブジェクトごとに1ステップ消費し、使い切った後のオブジェクトはスキップします。
+    - target (tuple, optional): 期待される出力のシグネチャ（形状、色ごとの画素数）。それを生成できないオブジェクトはスキップします。
 
     Returns:
     - objects (numpy.ndarrayのリスト): 正確に1つのオブジェクトを含む入力のリスト。
     """
     if object_maps is None:
         object_maps = get_object_maps(array)
-    objects = [augment(keep_one_object(array, object_map, bg_color=bg_color)) for object_map in object_maps if np.count_nonzero(object_map) > 0]
+    objects = []
+    for object_map in object_maps:
+        if budget is not None and not budget.step():
+            break
+        if np.count_nonzero(object_map) > 0:
+            if target is None or signature_can_match(target, array.shape, get_one_object_color_counts(array, object_map, bg_color=bg_color), augment):
+                objects.append(augment(keep_one_object(array, object_map, bg_color=bg_color)))
     return objects
 
 
@@ -555,72 +458,169 @@ get_object_map_funcs = [get_objects_by_connectivity_, partial(get_objects_by_con
                         get_objects_rectangles, partial(get_objects_rectangles, direction='horisontal'), get_objects_rectangles_without_noise, get_objects_rectangles_without_noise_without_padding]
 
 
+# トレーニング出力を生成しうる拡張オプションを求める関数
+def get_feasible_augments(task, object_maps_list, get_object_func):
+    """
+    `simple_output_process_options`に対する事前チェック。すべてのトレーニングペアで、いずれかの候補の形状が出力の形状になり、さらにzoomとrepeatでは出力が対応する周期性（`get_periodicity`）を持つ場合にオプションは実行可能とします。
+
+    Args:
+    - task (Task): 入力-出力ペアを含むタスクオブジェクト。
+    - object_maps_list (list): 各トレーニング入力のオブジェクトマップ。
+    - get_object_func (function): 候補生成関数（`get_cropped_objects`または`get_inputs_with_one_object`）。
+
+    Returns:
+    - feasible (set): `simple_output_process_options`の実行可能なオプションのインデックス。
+    """
+    shapes_list = []
+    for input_, object_maps in zip(task.inputs, object_maps_list):
+        shapes = set(get_object_maps_shapes(object_maps))
+        if get_object_func is get_inputs_with_one_object and shapes:
+            shapes = {input_.shape}
+        shapes_list.append(shapes)
+    feasible = set()
+    for j, augment in enumerate(simple_output_process_options):
+        if not all(periodicity_can_match(augment, output) for output in task.outputs):
+            continue
+        if all(any(get_output_shape(augment, shape) == output.shape for shape in shapes) for shapes, output in zip(shapes_list, task.outputs)):
+            feasible.add(j)
+    return feasible
+
+
 # タスクの入力に基づいてパートタイプを予測する関数
-def predict_part_types(task):
+def predict_part_types(task, budget=None):
     """
     入力の特性と候補生成に基づいて、タスクの解のタイプを予測します。
 
     Args:
     - task (Task): 解を予測する入力を含むタスクオブジェクト。
+    - budget (Budget, optional): 探索の時間/ステップ予算。指定しない場合は無制限。使い切ると探索を止め、その段階を`budget.stopped_stage`に残し、最も多くのトレーニングペアを解いた候補生成関数で予測します。
 
     Returns:
     - predictions (list): 解ける場合は各入力の予測解のリスト、そうでない場合は空のリスト。
     """
     predictions = []
+    if budget is None:
+        budget = Budget()
 
     if check_output_color_from_input(task):
+        budget.stage = 'detect_bg_'
         bg_colors = [detect_bg_(input_) for input_ in task.inputs]
         for i, get_object_maps in enumerate(get_object_map_funcs):
+            budget.stage = f'get_object_map_funcs[{i}]'
+            if not budget.step():
+                break
 
-            object_maps_list = [get_object_maps(input_, bg_color=bg_color) for input_, bg_color in zip(task.inputs, bg_colors)]
+            with span(f'get_object_map_funcs[{i}]', 'extractor'):
+                object_maps_list = [get_object_maps(input_, bg_color=bg_color) for input_, bg_color in zip(task.inputs, bg_colors)]
             for get_object_func in (get_cropped_objects, get_inputs_with_one_object):
-                for augment in simple_output_process_options:
+                feasible_augments = get_feasible_augments(task, object_maps_list, get_object_func)
+                for j, augment in enumerate(simple_output_process_options):
+                    if j not in feasible_augments:
+                        continue
+                    budget.stage = f'get_object_map_funcs[{i}] / {get_object_func.__name__} / simple_output_process_options[{j}]'
+                    if not budget.step():
+                        break
                     get_candidates = partial(get_object_func, get_object_maps=get_object_maps, augment=augment)
-                    predictions = predict_part(task, get_candidates=get_candidates, train_object_maps=object_maps_list, train_bg_colors=bg_colors)
+                    with span(f'{get_object_func.__name__} / simple_output_process_options[{j}]', 'augment', {'extractor': i}):
+                        predictions = predict_part(task, get_candidates=get_candidates, train_object_maps=object_maps_list, train_bg_colors=bg_colors, budget=budget)
                     if predictions:
                         break
-                if predictions:
+                if predictions or budget.exhausted:
                     break
-            if predictions:
+            if predictions or budget.exhausted:
                 break
 
+    if budget.exhausted and not predictions:
+        print('予算を使い切りました:', budget.stopped_stage)
+        if budget.best_partial is not None:
+            predictions = predict_test_inputs(task, budget.best_partial)
+
     return predictions
 
 
-# 予測を提出し、新しい提出CSVファイルを作成する関数
-def submit(predict):
+# ジャーナルにまだないテストタスクを読み込む関数
+def get_pending_tasks(journal, task_ids):
     """
-    テストタスクの予測を提出し、新しい提出CSVファイルを作成します。
+    ジャーナルにあるタスクをスキップしながら、テストタスクを1つずつ読み込みます。
+
+    Args:
+    - journal (SubmissionJournal): 終了したタスクのジャーナル。
+    - task_ids (list): すべてのテストタスクのIDが順番に追加されるリスト。
+
+    Returns:
+    - generator: 解くべきテストタスク。
+    """
+    for task in load_tasks(test_challenges_path, lazy=True):
+        task_ids.append(task.task_id)
+        if task.task_id not in journal:
+            yield task
+
+
+# ソルバーのカウンタと時間をタスクIDの下にまとめてタスクを予測する関数
+def predict_traced(predict, task):
+    """
+    トレーサーのタスク内でタスクを予測し、トレースファイルで各タスクが個別に表示されるようにします。
 
     Args:
     - predict (function): タスクの解を予測する関数。
+    - task (Task): 予測するタスク。
+
+    Returns:
+    - list: 各テスト入力の予測。
+    """
+    with tracer.task(task.task_id):
+        return predict(task)
+
+
+# 予測を提出し、中断した実行を再開できるように各タスクをジャーナルに記録する関数
+def submit(predict, journal_path='submission_journal.jsonl', resume=False, n_jobs=1):
+    """
+    テストタスクの予測を提出し、タスクごとにジャーナルに記録してsubmission.jsonを書き込みます。
+
+    Args:
+    - predict (function): タスクの解を予測する関数。
+    - journal_path (str): 終了したタスクを追記するジャーナルのパス。
+    - resume (bool): 既存のジャーナルを残し、そこにあるタスクをスキップするかどうか。
+    - n_jobs (int): タスクを解くプロセス数。1の場合はメインスレッドで解きます。
+      キャッシュの統計とトレースファイルはn_jobs=1の場合のみ収集されます。
 
     Returns:
     - None
     """
-    submission = pd.read_csv(sample_submission_path, index_col='output_id')
-    submission['output'] = ''
-    test_fns = sorted(os.listdir(test_path))
     count = 0
-    for fn in test_fns:
-        fp = test_path / fn
-        with open(fp, 'r') as f:
-            task = Task(json.load(f))
-            all_input_preds = predict(task)
+    task_ids = []
+    with SubmissionJournal(journal_path, resume=resume) as journal:
+        # ライタースレッドからタスクの順序で呼び出される
+        def write(task, all_input_preds, seconds, error):
+            nonlocal count
+            if error is not None:
+                print('Failed:', task.task_id, error)
             if all_input_preds:
-                print(fn)
+                print(task.task_id)
                 count += 1
+            # ワーカープロセスを終了させたタスクはジャーナルに記録せず、再開した実行で再び解く
+            journal.write(task.task_id, all_input_preds, n_test=len(task.test_inputs), seconds=seconds,
+                          durable=not worker_died(error))
+
+        stats = run_pipeline(partial(predict_traced, predict), get_pending_tasks(journal, task_ids), write, n_jobs=n_jobs)
 
-            for i, preds in enumerate(all_input_preds):
-                output_id = str(fn.split('.')[-2]) + '_' + str(i)
-                string_preds = [get_string(pred) for pred in preds[:3]]
-                pred = ' '.join(string_preds)
-                submission.loc[output_id, 'output'] = pred
+        # ジャーナルからARC Prize 2024のガイドラインに従った提出ファイルを作成
+        journal.write_submission('submission.json', task_ids)
 
     print(count)
-    submission.to_csv('old_submission.csv')  # 提出をCSVに保存
-    # ARC Prize 2024のガイドラインに従った提出ファイルを作成
-    translate_submission('/kaggle/working/old_submission.csv')
+    if journal.resumed:
+        print(journal.resumed, 'タスクを', journal_path, 'から再開しました')
+    print_pipeline_stats(stats)
+    if n_jobs != 1:
+        # ソルバーのカウンタとトレースはワーカープロセスに残る
+        print('キャッシュの統計とトレースファイルにはn_jobs=1が必要です')
+    else:
+        print(grid_cache.info())
+    if tracer.enabled and n_jobs == 1:
+        # arclibのインポート前にARCLIB_TRACE=1を設定した場合：ソルバーのタスクごとのカウンタと時間
+        tracer.write_jsonl('trace.jsonl')
+        tracer.write_chrome_trace('trace.json')
+    print(f"✅ 提出が 'submission.json' として保存されました（{len(task_ids)}タスク）")
 
 
 
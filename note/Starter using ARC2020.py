@@ -6,15 +6,14 @@
 #
 # ## Functionality
 # This notebook provides functionalities to:
-# - Translate submissions from an old CSV format to the new JSON format required for ARC Prize 2024.
 # - Predict solutions for ARC tasks using various techniques such as object detection and manipulation.
-# - Generate a submission CSV file following the competition guidelines.
+# - Write the `submission.json` file following the competition guidelines while tasks are being solved.
 #
 # ## Guidelines
 # To use this notebook effectively:
 # 1. **Data Preparation**:
 #    - Ensure the required JSON files (`arc-agi_test_challenges.json`) are located in the specified directory (`/kaggle/input/arc-prize-2024/`).
-#    - The script automatically creates a `test` directory to store individual task JSON files.
+#    - Tasks are read straight from the combined JSON file, no per-task files are written.
 #
 # **🌟 Explore my profile and other public projects, and don't forget to share your feedback!**
 #
@@ -24,16 +23,17 @@
 # 2. **Submission Process**:
 #    - Implement and refine the `predict_part_types` function to predict solutions based on input tasks.
 #    - Utilize methods such as object detection (`get_objects_by_connectivity_`, `get_objects_by_color_`) to generate predictions.
-#    - Ensure predictions are formatted correctly into a submission CSV (`sample_submission.csv`).
+#    - Predictions are written as `attempt_1`/`attempt_2` of every test input straight into `submission.json`.
 #
 # 3. **Execution**:
 #    - Execute the `main()` function to initiate the submission process.
 #    - Review the generated `submission.json` file to verify the format and contents of your submission.
 #
 # ## Working Details
-# - **Data Loading**: JSON files are loaded and split into individual task files for processing.
+# - **Data Loading**: The combined challenges JSON file is read once and tasks are created from it one by one with `load_tasks`.
 # - **Prediction**: Tasks are analyzed using functions like `predict_part_types` to generate predictions based on detected objects and their attributes.
-# - **Submission**: Predictions are compiled into a CSV file (`old_submission.csv`) and translated into the required JSON format (`submission.json`) using the `translate_submission` function.
+# - **Submission**: Predictions and the solving time of every task are appended to a journal (`submission_journal.jsonl`) as soon as the task is solved, and the required JSON format (`submission.json`) is assembled from the journal at the end, without an intermediate CSV file. A run interrupted halfway can be continued with `submit(predict_part_types, resume=True)`, which skips the tasks already in the journal.
+# - **Pipeline**: Loading, solving and writing run as a pipeline (`run_pipeline`): a loader thread parses the next tasks while the current one is solved, and a writer thread journals the results in task order. The bounded queues between the stages keep at most a few tasks in memory, and the utilization of every stage is printed at the end.
 #
 #
 # ## Acknowledgments 🙏
@@ -53,10 +53,7 @@
 # 📚 Importing necessary libraries 📊
 
 import os  # For operating system related operations
-import json  # For JSON manipulation
-import csv  # For CSV file operations
 import numpy as np  # NumPy for numerical operations
-import pandas as pd  # Pandas for data manipulation
 from pathlib import Path  # Pathlib for path operations
 import sys
 
@@ -74,9 +71,15 @@ pprint.pprint(sys.path)
 
 # Importing specific functions and classes from arclib 📦
 from arclib.dsl import *
-from arclib.util import evaluate_predict_func, get_string, data_path
+from arclib.util import evaluate_predict_func, get_string, data_path, load_tasks
 from arclib.dsl import Task, unique_arrays
 from arclib.check import check_output_color_from_input
+from arclib.cache import grid_cache
+from arclib.budget import Budget
+from arclib.features import ObjectTable, learn_selectors, rank_selected_rows
+from arclib.trace import tracer, traced, span
+from arclib.submission import SubmissionJournal
+from arclib.pipeline import run_pipeline, print_pipeline_stats, worker_died
 
 
 # %% [markdown]
@@ -86,223 +89,30 @@ from arclib.check import check_output_color_from_input
 # %% [markdown]
 # ### Overview
 #
-# This script loads JSON content from a specified file, creates a directory named 'test' if it doesn't exist, and then splits the loaded JSON content into individual files. Each task from the JSON data is saved as a separate JSON file in the 'test' directory.
+# This cell points to the combined JSON file with all test tasks. The tasks are not split into individual files: `load_tasks` from `arclib.util` reads the file once and creates `Task` objects from it directly.
 #
 # ### Steps and Functionality
 #
-# 1. **Loading JSON Content**
-#    - Opens and loads JSON data from the file specified by `json_file_path`.
-#    - Stores the loaded JSON data into the `data` variable for further processing.
+# 1. **Pointing to the JSON Content**
+#    - `test_challenges_path` is the combined file with all test tasks (`{task_id: task}`).
 #
-# 2. **Creating Output Directory**
-#    - Defines `output_dir` as the path where individual JSON files will be stored (`'/kaggle/working/test'` by default).
-#    - Uses `os.makedirs(output_dir, exist_ok=True)` to create the directory if it doesn't already exist (`exist_ok=True` ensures no errors if the directory already exists).
-#
-# 3. **Splitting JSON Content**
-#    - Iterates through each `task_id` and `task_data` pair in the loaded JSON data (`data.items()`).
-#    - Constructs the output file path for each task using `os.path.join(output_dir, f'{task_id}.json')`.
-#    - Opens each output file in write mode (`'w'`) and writes the corresponding `task_data` into the file using `json.dump(task_data, output_file, indent=4)` for better readability.
+# 2. **Loading Tasks**
+#    - `load_tasks(path)` accepts both the combined file and a directory with one JSON file per task.
+#    - `load_tasks(path, solutions_path)` adds test outputs from a combined solutions file.
+#    - `load_tasks(path, lazy=True)` returns a generator that parses one task at a time, so parsed JSON and NumPy copies of all tasks are never held at the same time.
+#    - Every task gets its `task_id`, which is used for the submission `output_id`.
 #
 # ### Usage
 #
-# - Ensure that `json_file_path` points to the correct location and filename of your JSON data (`arc-agi_test_challenges.json` in this case).
-# - The script will create a directory named 'test' in the working directory (`/kaggle/working/`) and store each task from the JSON data as a separate JSON file within that directory.
-# - This approach is useful for organizing and managing individual tasks or datasets that are originally stored in a single JSON file.
+# - Ensure that `test_challenges_path` points to the correct location and filename of your JSON data (`arc-agi_test_challenges.json` in this case).
 #
 # ---
 #
 
 # %% [code] {"execution": {"iopub.execute_input": "2024-06-13T14:56:16.151456Z", "iopub.status.busy": "2024-06-13T14:56:16.150939Z", "iopub.status.idle": "2024-06-13T14:56:16.371466Z", "shell.execute_reply": "2024-06-13T14:56:16.370201Z"}, "papermill": {"duration": 0.228738, "end_time": "2024-06-13T14:56:16.374433", "exception": false, "start_time": "2024-06-13T14:56:16.145695", "status": "completed"}, "tags": []}
 
-# Load the JSON content
-json_file_path = '/kaggle/input/arc-prize-2024/arc-agi_test_challenges.json'  # 🌐 Replace with the actual path to your JSON file
-with open(json_file_path, 'r') as file:
-    data = json.load(file)
-
-# Create the 'test' directory
-output_dir = '/kaggle/working/test'  # 📁 You can change this path as needed
-os.makedirs(output_dir, exist_ok=True)
-
-# Split the JSON content into individual files
-for task_id, task_data in data.items():
-    output_file_path = os.path.join(output_dir, f'{task_id}.json')
-    with open(output_file_path, 'w') as output_file:
-        json.dump(task_data, output_file, indent=4)
-
-
-# %% [markdown]
-# # 📄 Load the JSON content
-#
-
-# %% [markdown]
-# ### Overview
-#
-# This script reads a JSON file containing submission data, converts each entry into a specified CSV format, and writes it to a CSV file. The CSV file is structured with two columns: `output_id` and `output`, where `output` is derived from the JSON data after converting 2D matrices into a string format suitable for CSV.
-#
-# ### Steps and Functionality
-#
-# 1. **Reading JSON Data**
-#    - The script starts by opening and loading data from the JSON file specified by `json_file_path`.
-#
-# 2. **Defining Output CSV File**
-#    - Defines the output path for the CSV file where the converted data will be saved (`output_csv_path`).
-#
-# 3. **Converting 2D List to CSV String Format**
-#    - Defines a function `convert_to_csv_format(matrix)` that converts a 2D list (matrix) into a string format suitable for CSV. It joins elements of each row with '|' and encloses them between '|' symbols.
-#
-# 4. **Writing to CSV File**
-#    - Opens the `output_csv_path` in write mode (`'w'`) and initializes a `csv.DictWriter` instance to write data to the CSV file.
-#    - Writes the header row (`'output_id', 'output'`) using `writer.writeheader()`.
-#
-# 5. **Processing Each Task**
-#    - Iterates through each `task_id` and associated `attempts` in the loaded JSON data (`data.items()`).
-#    - Checks if there is only one attempt (`len(attempts) == 1`). If true:
-#      - Formats `output_id` as `{task_id}_0`.
-#      - Converts `attempt['attempt_1']` and `attempt['attempt_2']` to CSV format using `convert_to_csv_format`.
-#      - Combines both attempts into `combined_output` and writes to the CSV file.
-#    - If there are multiple attempts, iterates through each attempt (`enumerate(attempts)`) and formats `output_id` accordingly.
-#
-# 6. **Completion Message**
-#    - Prints a completion message (`"✅ Sample submission CSV file created at {output_csv_path}"`) indicating that the CSV file has been successfully created.
-#
-# ### Usage
-#
-# - Ensure that `json_file_path` points to the correct location and format of the input JSON file (`sample_submission.json` in this case).
-# - After execution, `sample_submission.csv` will contain the processed submission data in the specified format suitable for submission.
-#
-# ---
-#
-
-# %% [code] {"execution": {"iopub.execute_input": "2024-06-13T14:56:16.383963Z", "iopub.status.busy": "2024-06-13T14:56:16.383566Z", "iopub.status.idle": "2024-06-13T14:56:16.404391Z", "shell.execute_reply": "2024-06-13T14:56:16.402072Z"}, "papermill": {"duration": 0.028758, "end_time": "2024-06-13T14:56:16.407393", "exception": false, "start_time": "2024-06-13T14:56:16.378635", "status": "completed"}, "tags": []}
-json_file_path = '/kaggle/input/arc-prize-2024/sample_submission.json'
-
-with open(json_file_path, 'r') as file:
-    data = json.load(file)
-
-# Define the output CSV file path
-output_csv_path = '/kaggle/working/sample_submission.csv'
-
-# Function to convert a 2D list into the required string format
-def convert_to_csv_format(matrix):
-    return '|' + '|'.join(''.join(map(str, row)) for row in matrix) + '|'
-
-# Process and write to the CSV file
-with open(output_csv_path, 'w', newline='') as csvfile:
-    fieldnames = ['output_id', 'output']
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    writer.writeheader()
-
-    for task_id, attempts in data.items():
-        if len(attempts) == 1:
-            attempt = attempts[0]
-            output_id = f"{task_id}_0"
-            attempt_1 = convert_to_csv_format(attempt['attempt_1'])
-            attempt_2 = convert_to_csv_format(attempt['attempt_2'])
-            combined_output = f"{attempt_1} {attempt_2}"
-            writer.writerow({'output_id': output_id, 'output': combined_output})
-        else:
-            for i, attempt in enumerate(attempts):
-                output_id = f"{task_id}_{i}"
-                attempt_1 = convert_to_csv_format(attempt['attempt_1'])
-                attempt_2 = convert_to_csv_format(attempt['attempt_2'])
-                combined_output = f"{attempt_1} {attempt_2}"
-                writer.writerow({'output_id': output_id, 'output': combined_output})
-
-print(f"✅ Sample submission CSV file created at {output_csv_path}")
-
-
-# %% [markdown]
-# # 🔄 Function to translate csv to json
-#
-
-# %% [markdown]
-#
-# ### Overview
-#
-# This function converts an old submission format stored in a CSV file to a new JSON format required for the ARC Prize 2024 competition. It processes each line of the CSV, extracts relevant information, and structures it into a JSON format suitable for submission.
-#
-# ### Steps and Functionality
-#
-# 1. **Reading and Parsing CSV File**
-#    - The function begins by opening and reading the CSV file specified by `file_path`.
-#    - It reads all lines except the header line (`lines[1:]`) to skip the header information.
-#
-# 2. **Processing Each Line**
-#    - For each line in the CSV file:
-#      - Extract `output_id` and `output` by splitting the line on `,`.
-#      - Split `output_id` into `task_id` and `output_idx` to identify the task and attempt index.
-#      - Split `output` based on spaces `' '` to retrieve individual predictions.
-#      - It considers only the first two predictions if more than two are present.
-#      - Converts each prediction into a matrix format (`pred_matrix`) by parsing and mapping integers from '|' delimited string lines (`pred_lines`).
-#
-# 3. **Organizing Attempts**
-#    - Structures each attempt (`attempt_dict`) as a dictionary with `"attempt_1"` and `"attempt_2"` keys representing matrices for the first and second attempts respectively.
-#    - Inserts the attempt into `submission_dict` under the corresponding `task_id`. Inserts at the beginning (`insert(0, ...)`) if it's the first attempt (`output_idx == '0'`), otherwise appends it.
-#
-# 4. **Writing to JSON File**
-#    - Finally, writes the structured `submission_dict` to a new JSON file named `'submission.json'`.
-#    - Uses `json.dump()` with `indent=4` for readability, formatting the JSON with indentation.
-#    
-# 5. **Confirmation Message**
-#    - Prints a confirmation message (`"✅ Translated submission saved as 'submission.json'"`) indicating successful completion of the translation process.
-#
-# ### Usage
-#
-# - Ensure the CSV file (`file_path`) contains the correct format as expected by the function.
-# - After execution, `'submission.json'` will contain the transformed submission data ready for submission to the ARC Prize 2024 competition.
-#
-# ---
-#
-#
-
-# %% [code] {"execution": {"iopub.execute_input": "2024-06-13T14:56:16.416592Z", "iopub.status.busy": "2024-06-13T14:56:16.416176Z", "iopub.status.idle": "2024-06-13T14:56:16.429063Z", "shell.execute_reply": "2024-06-13T14:56:16.427843Z"}, "papermill": {"duration": 0.020558, "end_time": "2024-06-13T14:56:16.431688", "exception": false, "start_time": "2024-06-13T14:56:16.41113", "status": "completed"}, "tags": []}
-# 🔄 Function to translate from old submission format (csv) to new one (json)
-
-def translate_submission(file_path):
-    # Read the original submission file
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    submission_dict = {}
-
-    for line in lines[1:]:  # Skip the header line
-        output_id, output = line.strip().split(',')
-        task_id, output_idx = output_id.split('_')
-        predictions = output.split(' ')  # Split predictions based on ' '
-        
-        # Take only the first two predictions
-        if len(predictions) > 2:
-            predictions = predictions[:2]
-
-        processed_predictions = []
-        for pred in predictions:
-            if pred:  # Check if pred is not an empty string
-                pred_lines = pred.split('|')[1:-1]  # Remove empty strings from split
-                pred_matrix = [list(map(int, line)) for line in pred_lines]
-                processed_predictions.append(pred_matrix)
-
-        attempt_1 = processed_predictions[0] if len(processed_predictions) > 0 else []  # Attempt 1 matrix
-        attempt_2 = processed_predictions[1] if len(processed_predictions) > 1 else []  # Attempt 2 matrix
-
-        if task_id not in submission_dict:
-            submission_dict[task_id] = []
-
-        attempt_dict = {
-            "attempt_1": attempt_1,
-            "attempt_2": attempt_2
-        }
-
-        if output_idx == '0':
-            submission_dict[task_id].insert(0, attempt_dict)  # Insert first attempt
-        else:
-            submission_dict[task_id].append(attempt_dict)  # Append subsequent attempts
-    
-    # Write to the new json file
-    with open('submission.json', 'w') as file:
-        json.dump(submission_dict, file, indent=4)  # Save JSON with indentation for readability
-
-    print(f"✅ Translated submission saved as 'submission.json'")  # Confirmation message after successful translation
-
+# Combined JSON file with all test tasks, read by `load_tasks` in `submit`
+test_challenges_path = '/kaggle/input/arc-prize-2024/arc-agi_test_challenges.json'  # 🌐 Replace with the actual path to your JSON file
 
 
 # %% [markdown]
@@ -316,13 +126,10 @@ def translate_submission(file_path):
 #
 # ```python
 # data_path = Path('/kaggle/working/')  # 📁 Path to working directory
-# test_path = data_path / 'test'         # 📁 Path to test directory
-# sample_submission_path = '/kaggle/working/sample_submission.csv'  # 📄 Path to sample submission CSV
 # ```
 #
 # - **Explanation**: 
-#   - `data_path` and `test_path`: Define the directories where input data (tasks) and test files are stored respectively.
-#   - `sample_submission_path`: Points to the sample submission CSV file where predictions will be formatted and written.
+#   - `data_path`: Defines the working directory; test tasks are read from `test_challenges_path` defined above.
 #
 # #### 2. Checking Output Against Candidates
 #
@@ -331,13 +138,7 @@ def translate_submission(file_path):
 #     """
 #     Checks if the given output matches any of the candidate outputs.
 #     """
-#     output_is_candidate = False
-#
-#     for candidate in candidates:
-#         if output.shape == candidate.shape:
-#             if (output == candidate).all():
-#                 output_is_candidate = True
-#                 break
+#     output_is_candidate = contains_array(candidates, output)
 #     return output_is_candidate
 # ```
 #
@@ -386,60 +187,52 @@ def translate_submission(file_path):
 # #### 6. Submission and Result Handling
 #
 # ```python
-# def submit(predict):
+# def submit(predict, journal_path='submission_journal.jsonl', resume=False, n_jobs=1):
 #     """
-#     Submits predictions for test tasks and creates a new submission CSV file.
+#     Submits predictions for test tasks, journals them task by task and writes submission.json.
 #     """
 #     # Implementation details as explained in the code above...
 # ```
 #
 # - **Explanation**: 
-#   - `submit`: Reads test tasks, predicts outputs using `predict`, formats them according to the competition requirements, and outputs them to `old_submission.csv`, which is then translated into the final submission format using `translate_submission`.
+#   - `submit`: Reads test tasks in a loader thread, predicts outputs using `predict` (in a process pool with `n_jobs > 1`) and a writer thread appends the first two predictions of every test input as `attempt_1` and `attempt_2`, together with the solving time, to the journal `SubmissionJournal`. With `resume=True` the tasks already in the journal are not solved again. A task that kills its worker process, also when solved again alone, is not journaled, so a resumed run tries it again. Cache statistics and the trace files (`ARCLIB_TRACE=1`) are only collected with `n_jobs=1`, since the solver counters stay in the worker processes otherwise. At the end `submission.json` is assembled from the journal in the order of the test tasks.
 #
 # ### Execution Flow
 #
 # - **Main Execution**: The `main()` function is called when the script runs, which in turn calls `submit(predict_part_types)`.
 # - **Submission Process**: 
-#   - Reads the sample submission CSV.
-#   - Iterates through test files, predicts outputs using `predict_part_types`.
-#   - Formats predictions and saves them to `old_submission.csv`.
-#   - Translates the CSV submission to the required JSON format for ARC Prize 2024.
+#   - Opens the journal `submission_journal.jsonl` (kept as it is with `resume=True`, started anew otherwise).
+#   - Loads test tasks with `load_tasks` in a loader thread, skipping the tasks already in the journal, while `predict_part_types` predicts the outputs of the tasks loaded before.
+#   - Appends the predictions and the time of each task to the journal in a writer thread right after the task is solved.
+#   - Assembles `submission.json` in the JSON format required for ARC Prize 2024 from the journal, tasks without predictions get empty attempts.
 #
 #
 #
 
 # %% [code] {"execution": {"iopub.execute_input": "2024-06-13T14:56:16.441016Z", "iopub.status.busy": "2024-06-13T14:56:16.440555Z", "iopub.status.idle": "2024-06-13T14:56:54.530407Z", "shell.execute_reply": "2024-06-13T14:56:54.52903Z"}, "papermill": {"duration": 38.097796, "end_time": "2024-06-13T14:56:54.533141", "exception": false, "start_time": "2024-06-13T14:56:16.435345", "status": "completed"}, "tags": []}
-# 📂 Add pointers to files and sample submission CSV created above from ARC Prize JSONs
+# 📂 Add a pointer to the working directory
 
 data_path = Path('/kaggle/working/')  # 📁 Path to working directory
-test_path = data_path / 'test'  # 📁 Path to test directory
-
-sample_submission_path = '/kaggle/working/sample_submission.csv'  # 📄 Path to sample submission CSV
 
 # Function to check if output matches any candidate
+@traced(category='solver')
 def check_output_in_candidates(output, candidates):
     """
     Checks if the given output matches any of the candidate outputs.
 
     Args:
     - output (numpy.ndarray): The output matrix to compare.
-    - candidates (list of numpy.ndarray): List of candidate matrices to compare against.
+    - candidates (list of numpy.ndarray or ArraySet): Candidate matrices to compare against, only the ones with the shape of the output are compared.
 
     Returns:
     - output_is_candidate (bool): True if output matches any candidate, False otherwise.
     """
-    output_is_candidate = False
-
-    for candidate in candidates:
-        if output.shape == candidate.shape:
-            if (output == candidate).all():
-                output_is_candidate = True
-                break
+    output_is_candidate = contains_array(candidates, output)
     return output_is_candidate
 
 
 # Function to predict based on task inputs and candidates
-def predict_part(task, get_candidates, train_object_maps=None, train_bg_colors=None):
+def predict_part(task, get_candidates, train_object_maps=None, train_bg_colors=None, budget=None):
     """
     Predicts solutions for tasks based on input-output pairs using candidate generation.
 
@@ -448,6 +241,10 @@ def predict_part(task, get_candidates, train_object_maps=None, train_bg_colors=N
     - get_candidates (function): Function to generate candidates based on input and object maps.
     - train_object_maps (list of numpy.ndarray, optional): Object maps for training inputs.
     - train_bg_colors (list, optional): Background colors for training inputs.
+    - budget (Budget, optional): Time/step budget of the search. If the task is not solved, the number of solved train pairs is recorded in it.
+
+    Candidates for train pairs are generated with the signature (shape, color counts) of the expected output, so candidates that can not match are never built.
+    When all train pairs are solved, object selectors (e.g. "largest object") that pick the right object in every train pair are learned and their choice is put first in the test predictions.
 
     Returns:
     - all_input_predictions (list): List of predictions for each test input if the task is fully solvable, otherwise an empty list.
@@ -457,7 +254,7 @@ def predict_part(task, get_candidates, train_object_maps=None, train_bg_colors=N
         input = np.array(input)
         output = np.array(output)
 
-        candidates = get_candidates(input, object_maps=train_object_maps[i], bg_color=train_bg_colors[i])
+        candidates = get_candidates(input, object_maps=train_object_maps[i], bg_color=train_bg_colors[i], budget=budget, target=get_signature(output))
 
         if candidates:
             if not check_output_in_candidates(output, candidates):
@@ -469,16 +266,82 @@ def predict_part(task, get_candidates, train_object_maps=None, train_bg_colors=N
 
     all_input_predictions = []
     if part_task:
-        for input in task.test_inputs:
-            test_candidates = get_candidates(input)
-            predictions = test_candidates
-            predictions = unique_arrays(predictions)
-            predictions = sorted(predictions, key=lambda x: x.shape[0] * x.shape[1], reverse=True)
-            all_input_predictions.append(predictions)
+        selectors = None
+        if train_object_maps is not None:
+            selectors = learn_object_selectors(task, get_candidates, train_object_maps, train_bg_colors)
+        all_input_predictions = predict_test_inputs(task, get_candidates, selectors=selectors)
+    elif budget is not None:
+        budget.record_partial(i, get_candidates)
 
-    else:
-        all_input_predictions = []
+    return all_input_predictions
+
+
+# Function to learn object selectors that pick the right object in every train pair
+def learn_object_selectors(task, get_candidates, train_object_maps, train_bg_colors):
+    """
+    Finds feature predicates (largest / smallest value or the only object with its value, see `arclib.features`) that select an object giving the train output in every train pair.
+
+    Args:
+    - task (Task): Task object containing input-output pairs.
+    - get_candidates (function): Candidate generator that solved all train pairs.
+    - train_object_maps (list of numpy.ndarray): Object maps for training inputs.
+    - train_bg_colors (list): Background colors for training inputs.
+
+    Returns:
+    - selectors (list): Learned selectors as (how, feature name) tuples.
+    """
+    objects_list = []
+    correct = []
+    for input_, output, object_maps, bg_color in zip(task.inputs, task.outputs, train_object_maps, train_bg_colors):
+        object_maps = [object_map for object_map in object_maps if np.count_nonzero(object_map) > 0]
+        objects_list.append(make_objects(input_, object_maps))
+        for object_map in object_maps:
+            candidates = get_candidates(input_, object_maps=[object_map], bg_color=bg_color)
+            correct.append(len(candidates) > 0 and np.array_equal(candidates[0], output))
+    return learn_selectors(ObjectTable(objects_list), np.array(correct, dtype=bool))
+
+
+# Function to get the candidates chosen by object selectors
+def get_selected_candidates(input_, get_candidates, selectors):
+    """
+    Applies learned object selectors to a test input.
 
+    Args:
+    - input_ (numpy.ndarray): Test input.
+    - get_candidates (function): Candidate generator, a partial of `get_cropped_objects` or `get_inputs_with_one_object`.
+    - selectors (list): Selectors from `learn_object_selectors`.
+
+    Returns:
+    - candidates (list of numpy.ndarray): Candidates of the selected objects, the object chosen by most selectors first.
+    """
+    object_maps = get_candidates.keywords['get_object_maps'](input_)
+    object_maps = [object_map for object_map in object_maps if np.count_nonzero(object_map) > 0]
+    table = ObjectTable([make_objects(input_, object_maps)])
+    return [get_candidates(input_, object_maps=[object_maps[row]])[0] for row in rank_selected_rows(table, selectors)]
+
+
+# Function to predict test inputs with a candidate generator that solved train pairs
+def predict_test_inputs(task, get_candidates, selectors=None):
+    """
+    Generates predictions for every test input of the task.
+
+    Args:
+    - task (Task): Task object containing test inputs.
+    - get_candidates (function): Function to generate candidates based on input.
+    - selectors (list, optional): Object selectors learned on train pairs; the candidates they choose go first.
+
+    Returns:
+    - all_input_predictions (list): List of unique candidates for each test input, selected ones first, then largest first.
+    """
+    all_input_predictions = []
+    for input in task.test_inputs:
+        test_candidates = get_candidates(input)
+        predictions = test_candidates
+        predictions = unique_arrays(predictions)
+        predictions = sorted(predictions, key=lambda x: x.shape[0] * x.shape[1], reverse=True)
+        if selectors:
+            predictions = unique_arrays(get_selected_candidates(input, get_candidates, selectors) + predictions)
+        all_input_predictions.append(predictions)
     return all_input_predictions
 
 
@@ -520,8 +383,31 @@ def keep_one_object(array, object_map, bg_color=None):
     return output_
 
 
+# Function to get color counts of keep_one_object output without building it
+def get_one_object_color_counts(array, object_map, bg_color=None):
+    """
+    Counts colors of the array that keep_one_object would return.
+
+    Args:
+    - array (numpy.ndarray): The input array containing multiple objects.
+    - object_map (numpy.ndarray): Binary map indicating the location of the object to keep.
+    - bg_color (int or float, optional): Background color to fill outside the object boundaries.
+
+    Returns:
+    - color_counts (numpy.ndarray or None): Pixel count of every color 0..9, None if it can not be computed.
+    """
+    if bg_color is None:
+        bg_color = detect_bg_(array)
+    cropped_object = get_cropped_object(array, object_map)
+    color_counts = get_color_counts(cropped_object)
+    if color_counts is None or not 0 <= bg_color <= 9:
+        return None
+    color_counts[bg_color] += array.size - cropped_object.size
+    return color_counts
+
+
 # Function to get cropped objects based on object maps
-def get_cropped_objects(array, get_object_maps=None, object_maps=None, augment=None, bg_color=None):
+def get_cropped_objects(array, get_object_maps=None, object_maps=None, augment=None, bg_color=None, budget=None, target=None):
     """
     Retrieves cropped objects from the input array based on the detected object maps.
 
@@ -531,18 +417,27 @@ def get_cropped_objects(array, get_object_maps=None, object_maps=None, augment=N
     - object_maps (list of numpy.ndarray, optional): Pre-detected object maps.
     - augment (function, optional): Function to apply augmentation to cropped objects.
     - bg_color (int or float, optional): Background color to fill outside the object boundaries.
+    - budget (Budget, optional): Time/step budget; one step per object, objects left when it runs out are skipped.
+    - target (tuple, optional): Signature (shape, color counts) of the expected output; objects that can not give it are skipped.
 
     Returns:
     - objects (list of numpy.ndarray): List of cropped objects extracted from the input array.
     """
     if object_maps is None:
         object_maps = get_object_maps(array)
-    objects = [augment(get_cropped_object(array, object_map)) for object_map in object_maps if np.count_nonzero(object_map) > 0]
+    objects = []
+    for object_map in object_maps:
+        if budget is not None and not budget.step():
+            break
+        if np.count_nonzero(object_map) > 0:
+            cropped_object = get_cropped_object(array, object_map)
+            if target is None or signature_can_match(target, cropped_object.shape, get_color_counts(cropped_object), augment):
+                objects.append(augment(cropped_object))
     return objects
 
 
 # Function to get inputs with one object based on object maps
-def get_inputs_with_one_object(array, get_object_maps=None, object_maps=None, augment=None, bg_color=None):
+def get_inputs_with_one_object(array, get_object_maps=None, object_maps=None, augment=None, bg_color=None, budget=None, target=None):
     """
     Retrieves inputs containing exactly one object based on detected object maps.
 
@@ -552,13 +447,21 @@ def get_inputs_with_one_object(array, get_object_maps=None, object_maps=None, au
     - object_maps (list of numpy.ndarray, optional): Pre-detected object maps.
     - augment (function, optional): Function to apply augmentation to retained objects.
     - bg_color (int or float, optional): Background color to fill outside the object boundaries.
+    - budget (Budget, optional): Time/step budget; one step per object, objects left when it runs out are skipped.
+    - target (tuple, optional): Signature (shape, color counts) of the expected output; objects that can not give it are skipped.
 
     Returns:
     - objects (list of numpy.ndarray): List of inputs with exactly one object retained.
     """
     if object_maps is None:
         object_maps = get_object_maps(array)
-    objects = [augment(keep_one_object(array, object_map, bg_color=bg_color)) for object_map in object_maps if np.count_nonzero(object_map) > 0]
+    objects = []
+    for object_map in object_maps:
+        if budget is not None and not budget.step():
+            break
+        if np.count_nonzero(object_map) > 0:
+            if target is None or signature_can_match(target, array.shape, get_one_object_color_counts(array, object_map, bg_color=bg_color), augment):
+                objects.append(augment(keep_one_object(array, object_map, bg_color=bg_color)))
     return objects
 
 
@@ -568,72 +471,169 @@ get_object_map_funcs = [get_objects_by_connectivity_, partial(get_objects_by_con
                         get_objects_rectangles, partial(get_objects_rectangles, direction='horisontal'), get_objects_rectangles_without_noise, get_objects_rectangles_without_noise_without_padding]
 
 
+# Function to find augment options that can give the train outputs
+def get_feasible_augments(task, object_maps_list, get_object_func):
+    """
+    Pre-pass over `simple_output_process_options`: an option is feasible if for every train pair some candidate shape turns into the output shape and, for zoom and repeat, the output has the matching periodicity (`get_periodicity`).
+
+    Args:
+    - task (Task): Task object containing input-output pairs.
+    - object_maps_list (list): Object maps for every training input.
+    - get_object_func (function): Candidate builder (`get_cropped_objects` or `get_inputs_with_one_object`).
+
+    Returns:
+    - feasible (set): Indices of feasible options in `simple_output_process_options`.
+    """
+    shapes_list = []
+    for input_, object_maps in zip(task.inputs, object_maps_list):
+        shapes = set(get_object_maps_shapes(object_maps))
+        if get_object_func is get_inputs_with_one_object and shapes:
+            shapes = {input_.shape}
+        shapes_list.append(shapes)
+    feasible = set()
+    for j, augment in enumerate(simple_output_process_options):
+        if not all(periodicity_can_match(augment, output) for output in task.outputs):
+            continue
+        if all(any(get_output_shape(augment, shape) == output.shape for shape in shapes) for shapes, output in zip(shapes_list, task.outputs)):
+            feasible.add(j)
+    return feasible
+
+
 # Function to predict part types based on task inputs
-def predict_part_types(task):
+def predict_part_types(task, budget=None):
     """
     Predicts types of solutions for tasks based on input characteristics and candidate generation.
 
     Args:
     - task (Task): Task object containing inputs to predict solutions for.
+    - budget (Budget, optional): Time/step budget of the search, unlimited if not given. When it runs out, the search stops, the stage is kept in `budget.stopped_stage` and the candidate generator that solved most train pairs is used for predictions.
 
     Returns:
     - predictions (list): List of predicted solutions for each input if solvable, otherwise an empty list.
     """
     predictions = []
+    if budget is None:
+        budget = Budget()
 
     if check_output_color_from_input(task):
+        budget.stage = 'detect_bg_'
         bg_colors = [detect_bg_(input_) for input_ in task.inputs]
         for i, get_object_maps in enumerate(get_object_map_funcs):
+            budget.stage = f'get_object_map_funcs[{i}]'
+            if not budget.step():
+                break
 
-            object_maps_list = [get_object_maps(input_, bg_color=bg_color) for input_, bg_color in zip(task.inputs, bg_colors)]
+            with span(f'get_object_map_funcs[{i}]', 'extractor'):
+                object_maps_list = [get_object_maps(input_, bg_color=bg_color) for input_, bg_color in zip(task.inputs, bg_colors)]
             for get_object_func in (get_cropped_objects, get_inputs_with_one_object):
-                for augment in simple_output_process_options:
+                feasible_augments = get_feasible_augments(task, object_maps_list, get_object_func)
+                for j, augment in enumerate(simple_output_process_options):
+                    if j not in feasible_augments:
+                        continue
+                    budget.stage = f'get_object_map_funcs[{i}] / {get_object_func.__name__} / simple_output_process_options[{j}]'
+                    if not budget.step():
+                        break
                     get_candidates = partial(get_object_func, get_object_maps=get_object_maps, augment=augment)
-                    predictions = predict_part(task, get_candidates=get_candidates, train_object_maps=object_maps_list, train_bg_colors=bg_colors)
+                    with span(f'{get_object_func.__name__} / simple_output_process_options[{j}]', 'augment', {'extractor': i}):
+                        predictions = predict_part(task, get_candidates=get_candidates, train_object_maps=object_maps_list, train_bg_colors=bg_colors, budget=budget)
                     if predictions:
                         break
-                if predictions:
+                if predictions or budget.exhausted:
                     break
-            if predictions:
+            if predictions or budget.exhausted:
                 break
 
+    if budget.exhausted and not predictions:
+        print('Budget exhausted at', budget.stopped_stage)
+        if budget.best_partial is not None:
+            predictions = predict_test_inputs(task, budget.best_partial)
+
     return predictions
 
 
-# Function to submit predictions and create a new submission CSV file
-def submit(predict):
+# Function to load the test tasks that are not in the journal yet
+def get_pending_tasks(journal, task_ids):
+    """
+    Loads test tasks one by one, skipping the tasks already in the journal.
+
+    Args:
+    - journal (SubmissionJournal): Journal of the finished tasks.
+    - task_ids (list): List the ids of all test tasks are appended to, in order.
+
+    Returns:
+    - generator: Test tasks to solve.
     """
-    Submits predictions for test tasks and creates a new submission CSV file.
+    for task in load_tasks(test_challenges_path, lazy=True):
+        task_ids.append(task.task_id)
+        if task.task_id not in journal:
+            yield task
+
+
+# Function to predict a task with its solver counters and timings grouped under the task id
+def predict_traced(predict, task):
+    """
+    Predicts a task inside a tracer task, so the trace files show every task separately.
 
     Args:
     - predict (function): Function to predict solutions for tasks.
+    - task (Task): Task to predict.
+
+    Returns:
+    - list: Predictions for every test input.
+    """
+    with tracer.task(task.task_id):
+        return predict(task)
+
+
+# Function to submit predictions, journaling every task so an interrupted run can be resumed
+def submit(predict, journal_path='submission_journal.jsonl', resume=False, n_jobs=1):
+    """
+    Submits predictions for test tasks, journals them task by task and writes submission.json.
+
+    Args:
+    - predict (function): Function to predict solutions for tasks.
+    - journal_path (str): Path of the append-only journal of finished tasks.
+    - resume (bool): Whether to keep the existing journal and skip the tasks already in it.
+    - n_jobs (int): Number of processes solving tasks, 1 solves them in the main thread.
+      Cache statistics and trace files are only collected with n_jobs=1.
 
     Returns:
     - None
     """
-    submission = pd.read_csv(sample_submission_path, index_col='output_id')
-    submission['output'] = ''
-    test_fns = sorted(os.listdir(test_path))
     count = 0
-    for fn in test_fns:
-        fp = test_path / fn
-        with open(fp, 'r') as f:
-            task = Task(json.load(f))
-            all_input_preds = predict(task)
+    task_ids = []
+    with SubmissionJournal(journal_path, resume=resume) as journal:
+        # Called from the writer thread in the order of the tasks
+        def write(task, all_input_preds, seconds, error):
+            nonlocal count
+            if error is not None:
+                print('Failed:', task.task_id, error)
             if all_input_preds:
-                print(fn)
+                print(task.task_id)
                 count += 1
+            # A task that killed its worker process is not journaled, so a resumed run solves it again
+            journal.write(task.task_id, all_input_preds, n_test=len(task.test_inputs), seconds=seconds,
+                          durable=not worker_died(error))
 
-            for i, preds in enumerate(all_input_preds):
-                output_id = str(fn.split('.')[-2]) + '_' + str(i)
-                string_preds = [get_string(pred) for pred in preds[:3]]
-                pred = ' '.join(string_preds)
-                submission.loc[output_id, 'output'] = pred
+        stats = run_pipeline(partial(predict_traced, predict), get_pending_tasks(journal, task_ids), write, n_jobs=n_jobs)
+
+        # Create a submission file that follows the ARC Prize 2024 guidelines from the journal
+        journal.write_submission('submission.json', task_ids)
 
     print(count)
-    submission.to_csv('old_submission.csv')  # Save submission to CSV
-    # Create a submission file that follows the ARC Prize 2024 guidelines
-    translate_submission('/kaggle/working/old_submission.csv')
+    if journal.resumed:
+        print(journal.resumed, 'tasks resumed from', journal_path)
+    print_pipeline_stats(stats)
+    if n_jobs != 1:
+        # Counters and traces of the solver stay in the worker processes
+        print('Cache statistics and trace files need n_jobs=1')
+    else:
+        print(grid_cache.info())
+    if tracer.enabled and n_jobs == 1:
+        # ARCLIB_TRACE=1 set before importing arclib: per-task counters and timings of the solver
+        tracer.write_jsonl('trace.jsonl')
+        tracer.write_chrome_trace('trace.json')
+    print(f"✅ Submission saved as 'submission.json' ({len(task_ids)} tasks)")
 
 
 
@@ -0,0 +1,437 @@
+# offline benchmarks for arclib, run from the note directory:
+#   python -m arclib.bench primitives --save bench.json
+#   python -m arclib.bench primitives --baseline bench.json --threshold 0.3
+#   python -m arclib.bench solver --tasks path/to/arc-agi_training_challenges.json --limit 100
+# the grid corpus is generated from a fixed seed, so results are comparable between runs and machines
+import argparse
+import ast
+from collections import defaultdict
+from functools import partial
+import json
+from pathlib import Path
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from arclib.dsl import (Task, rotate, flip, flip_diagonal, zoom, repeat, reverse_zoom, crop_without_bg,
+                        color_histogram, all_colors, get_color_counts, array_key, detect_bg_, get_periodicity,
+                        detect_zoom, detect_repeat, get_feasible_reversed_options, make_objects,
+                        get_objects_by_color_and_connectivity_)
+from arclib.cache import grid_cache
+from arclib.util import load_tasks
+import arclib.dsl
+
+STARTER_PATH = Path(__file__).resolve().parent.parent / 'Starter using ARC2020.py'
+
+
+### Corpus
+
+
+def random_grid(rng, kind):
+    # kind: 'noise', 'blocks', 'noisy_blocks', 'zoomed', 'tiled', 'objects'
+    h, w = rng.integers(1, 31, size=2)
+    if kind == 'noise':
+        return rng.integers(0, 10, size=(h, w)).astype(np.uint8)
+    if kind in ('zoomed', 'tiled'):
+        base = rng.integers(0, 10, size=rng.integers(1, 8, size=2)).astype(np.uint8)
+        n0, n1 = rng.integers(1, 4, size=2)
+        return zoom(base, n0, n1) if kind == 'zoomed' else repeat(base, n0, n1)
+    grid = np.full((h, w), rng.integers(0, 10) if kind == 'noisy_blocks' else 0, dtype=np.uint8)
+    for _ in range(rng.integers(1, 10)):
+        a0, a1 = rng.integers(0, h), rng.integers(0, w)
+        b0, b1 = a0 + rng.integers(1, 8), a1 + rng.integers(1, 8)
+        if kind == 'objects':
+            grid[a0:b0, a1:b1] = rng.integers(1, 10, size=grid[a0:b0, a1:b1].shape)
+        else:
+            grid[a0:b0, a1:b1] = rng.integers(0, 10)
+    if kind == 'noisy_blocks':
+        noise = rng.random((h, w)) < 0.1
+        grid[noise] = rng.integers(0, 10, size=noise.sum())
+    return grid
+
+
+grid_kinds = ('noise', 'blocks', 'noisy_blocks', 'zoomed', 'tiled', 'objects')
+
+
+def make_grid_corpus(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    return [random_grid(rng, grid_kinds[i % len(grid_kinds)]) for i in range(n)]
+
+
+def make_crop_task(rng, n_train=3):
+    # ARC-shaped task: the output is one object of the input, possibly rotated
+    angle = rng.integers(0, 4)
+    pairs = []
+    for _ in range(n_train + 1):
+        h, w = rng.integers(8, 20, size=2)
+        grid = np.zeros((h, w), dtype=np.uint8)
+        s0, s1 = rng.integers(2, 5, size=2)
+        a0, a1 = rng.integers(0, h - s0), rng.integers(0, w - s1)
+        grid[a0:a0 + s0, a1:a1 + s1] = rng.integers(1, 10, size=(s0, s1))
+        output = np.rot90(grid[a0:a0 + s0, a1:a1 + s1], angle)
+        pairs.append({'input': grid.tolist(), 'output': output.tolist()})
+    return {'train': pairs[:-1], 'test': pairs[-1:]}
+
+
+def make_random_task(rng, n_train=3):
+    # ARC-shaped task without a simple solution, the solver has to search everything
+    pairs = [{'input': random_grid(rng, grid_kinds[rng.integers(0, len(grid_kinds))]).tolist(),
+              'output': random_grid(rng, 'blocks').tolist()} for _ in range(n_train + 1)]
+    return {'train': pairs[:-1], 'test': pairs[-1:]}
+
+
+def make_task_corpus(n=40, seed=0):
+    rng = np.random.default_rng(seed)
+    tasks = []
+    for i in range(n):
+        task = make_crop_task(rng) if i % 2 == 0 else make_random_task(rng)
+        tasks.append(Task(task, idx=i, task_id=f'synthetic_{i:03d}'))
+    return tasks
+
+
+### Starter solver
+
+
+def load_starter(path=STARTER_PATH):
+    # imports, functions and constants of a starter script without its kaggle-only top level code
+    tree = ast.parse(Path(path).read_text(encoding='utf-8'))
+    keep = (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef, ast.Assign)
+    tree.body = [node for node in tree.body if isinstance(node, keep)]
+    namespace = {'__name__': 'starter'}
+    exec(compile(tree, str(path), 'exec'), namespace)
+    return namespace
+
+
+### Primitive benchmarks
+
+
+def get_benchmarks(starter=None):
+    # name -> func(grid)
+    benchmarks = {
+        'rotate': rotate,
+        'flip': flip,
+        'flip_diagonal': flip_diagonal,
+        'zoom_2_2': partial(zoom, n0=2, n1=2),
+        'repeat_2_2': partial(repeat, n0=2, n1=2),
+        'reverse_zoom_2_2': partial(reverse_zoom, n0=2, n1=2),
+        'crop_without_bg': lambda grid: crop_without_bg(grid, bg_color=0) if grid.any() else grid,
+        'color_histogram': color_histogram,
+        'all_colors': all_colors,
+        'get_color_counts': get_color_counts,
+        'array_key': array_key,
+        'detect_bg_': detect_bg_,
+        'get_periodicity': get_periodicity,
+        'detect_zoom_2_2': partial(detect_zoom, n0=2, n1=2),
+        'detect_repeat_2_2': partial(detect_repeat, n0=2, n1=2),
+        'get_feasible_reversed_options': get_feasible_reversed_options,
+        'make_objects_size': lambda grid: [obj.size for obj in make_objects(grid, get_objects_by_color_and_connectivity_(grid))],
+    }
+    if starter is not None:
+        for i, get_object_maps in enumerate(starter['get_object_map_funcs']):
+            benchmarks[f'extractor_{i}_{get_func_name(get_object_maps)}'] = get_object_maps
+    return benchmarks
+
+
+def get_func_name(func):
+    if isinstance(func, partial):
+        params = '_'.join(str(value) for value in func.keywords.values())
+        return func.func.__name__ + ('_' + params if params else '')
+    return func.__name__
+
+
+def percentiles(times):
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {'p50_us': p50 * 1e6, 'p95_us': p95 * 1e6, 'p99_us': p99 * 1e6}
+
+
+def run_benchmark(func, grids, repeats=3):
+    # grid cache is disabled, so every call does the work
+    enabled = grid_cache.enabled
+    grid_cache.enabled = False
+    try:
+        for grid in grids[:10]:
+            func(grid)
+        times = []
+        repeat_times = []
+        for _ in range(repeats):
+            for grid in grids:
+                start = time.perf_counter()
+                func(grid)
+                times.append(time.perf_counter() - start)
+            repeat_times.append(sum(times[-len(grids):]))
+        # allocations in a separate pass, tracemalloc slows every allocation down
+        allocated = []
+        tracemalloc.start()
+        for grid in grids:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            func(grid)
+            allocated.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+    finally:
+        grid_cache.enabled = enabled
+    # ops/sec of the fastest pass over the corpus, as timeit does, the others are more affected by noise
+    result = {'ops_per_sec': len(grids) / min(repeat_times), 'calls': len(times)}
+    result.update(percentiles(times))
+    result.update({'alloc_bytes_mean': float(np.mean(allocated)), 'alloc_bytes_max': int(np.max(allocated))})
+    return result
+
+
+def run_benchmarks(grids, benchmarks, repeats=3, name_filter=None):
+    results = {}
+    for name, func in benchmarks.items():
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = run_benchmark(func, grids, repeats=repeats)
+    return results
+
+
+def get_meta(**params):
+    meta = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine()}
+    meta.update(params)
+    return meta
+
+
+### Solver benchmark
+
+# solver stages by function name (functions of arclib.dsl and of the starter only),
+# time of a stage does not include time of the stages called from it
+solver_stages = {
+    'detect_bg_': 'detect_bg',
+    'get_objects_by_connectivity_': 'extraction',
+    'get_objects_by_color_and_connectivity_': 'extraction',
+    'get_objects_by_color_': 'extraction',
+    'get_objects_rectangles': 'extraction',
+    'get_objects_rectangles_without_noise': 'extraction',
+    'get_objects_rectangles_without_noise_without_padding': 'extraction',
+    'get_feasible_augments': 'pruning',
+    'get_cropped_objects': 'candidates',
+    'get_inputs_with_one_object': 'candidates',
+    'identity': 'augmentation',
+    'rotate': 'augmentation',
+    'flip': 'augmentation',
+    'flip_diagonal': 'augmentation',
+    'zoom': 'augmentation',
+    'repeat': 'augmentation',
+    'check_output_in_candidates': 'matching',
+    'unique_arrays': 'dedup',
+    'learn_object_selectors': 'selectors',
+    'get_selected_candidates': 'selectors',
+}
+
+
+class StageProfiler:
+    # exclusive time per solver stage with sys.setprofile, builtin sorted is the 'sorting' stage
+    # profiling slows python calls down, so stage times are only good as shares of the total
+    def __init__(self, filenames, stages=solver_stages):
+        self.filenames = set(filenames)
+        self.stages = stages
+        self.times = defaultdict(float)
+        self.stack = []  # [frame or builtin, stage, start, time of nested stages]
+
+    def push(self, key, stage):
+        self.stack.append([key, stage, time.perf_counter(), 0.0])
+
+    def pop(self):
+        key, stage, start, nested = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.times[stage] += elapsed - nested
+        if self.stack:
+            self.stack[-1][3] += elapsed
+
+    def __call__(self, frame, event, arg):
+        if event == 'call':
+            stage = self.stages.get(frame.f_code.co_name)
+            if stage is not None and frame.f_code.co_filename in self.filenames:
+                self.push(frame, stage)
+        elif event in ('return', 'exception'):
+            if self.stack and self.stack[-1][0] is frame:
+                self.pop()
+        elif event == 'c_call' and arg is sorted:
+            self.push(arg, 'sorting')
+        elif event in ('c_return', 'c_exception') and self.stack and self.stack[-1][0] is arg:
+            self.pop()
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        sys.setprofile(self)
+        return self
+
+    def __exit__(self, *exc):
+        sys.setprofile(None)
+        self.total = time.perf_counter() - self.start
+        while self.stack:
+            self.pop()
+
+    def shares(self):
+        # {stage: (seconds, share of total)}, 'other' is everything outside of the stages
+        times = dict(self.times)
+        times['other'] = max(self.total - sum(times.values()), 0.0)
+        return {stage: (seconds, seconds / self.total) for stage, seconds in sorted(times.items(), key=lambda x: -x[1])}
+
+
+def benchmark_solver(predict, tasks, top=10):
+    # per task latency of predict(task), the grid cache is cleared once before the run
+    grid_cache.clear()
+    times = []
+    solved = 0
+    start = time.perf_counter()
+    for task in tasks:
+        task_start = time.perf_counter()
+        predictions = predict(task)
+        times.append(time.perf_counter() - task_start)
+        solved += bool(predictions)
+    total = time.perf_counter() - start
+    times = np.array(times)
+    p50, p95, p99 = np.percentile(times, [50, 95, 99]) * 1000
+    slowest = np.argsort(-times, kind='stable')[:top]
+    return {
+        'tasks': len(tasks), 'solved': solved, 'seconds': total, 'tasks_per_sec': len(tasks) / total,
+        'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+        'slowest': [[get_task_name(tasks[i]), times[i] * 1000] for i in slowest.tolist()],
+    }
+
+
+def profile_solver_stages(predict, tasks, filenames):
+    grid_cache.clear()
+    with StageProfiler(filenames) as profiler:
+        for task in tasks:
+            predict(task)
+    return {stage: {'seconds': seconds, 'share': share} for stage, (seconds, share) in profiler.shares().items()}
+
+
+def get_task_name(task):
+    return task.task_id if task.task_id is not None else str(task.idx)
+
+
+def print_solver_result(result):
+    print(f"tasks {result['tasks']}, solved {result['solved']}, {result['seconds']:.2f} s, {result['tasks_per_sec']:.2f} tasks/s")
+    print(f"latency p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms")
+    print('slowest tasks:')
+    for name, ms in result['slowest']:
+        print(f'  {name:30s} {ms:10.1f} ms')
+    if 'stages' in result:
+        print('time by stage (profiled run):')
+        for stage, r in result['stages'].items():
+            print(f"  {stage:15s} {r['share']:6.1%} {r['seconds']:8.2f} s")
+
+
+### Baselines
+
+
+def compare_results(results, baseline, threshold=0.3, keys=(('ops_per_sec', -1), ('alloc_bytes_mean', 1))):
+    # regressions of results against baseline beyond threshold (relative),
+    # key sign: -1 - lower is worse, 1 - higher is worse; small allocations (< 1 KB) are ignored
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key, sign in keys:
+            old, new = baseline[name].get(key), result.get(key)
+            if old is None or new is None or old == 0:
+                continue
+            if key.startswith('alloc') and max(old, new) < 1024:
+                continue
+            change = (new - old) / old
+            if change * sign > threshold:
+                regressions.append(f'{name}: {key} {old:.4g} -> {new:.4g} ({change:+.0%})')
+    return regressions
+
+
+def save_results(path, results, meta):
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=1)
+
+
+def load_results(path):
+    with open(path, 'r') as f:
+        return json.load(f)['results']
+
+
+def print_results(results):
+    print(f'{"name":60s} {"ops/s":>10s} {"p50 us":>9s} {"p95 us":>9s} {"p99 us":>9s} {"alloc B":>9s}')
+    for name, r in results.items():
+        print(f'{name:60s} {r["ops_per_sec"]:10.0f} {r["p50_us"]:9.1f} {r["p95_us"]:9.1f} {r["p99_us"]:9.1f} {r["alloc_bytes_mean"]:9.0f}')
+
+
+def check_baseline(results, baseline_path, threshold, **kwargs):
+    # prints regressions, returns process exit code
+    regressions = compare_results(results, load_results(baseline_path), threshold=threshold, **kwargs)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    return 1 if regressions else 0
+
+
+### Command line
+
+
+def primitives_command(args):
+    grids = make_grid_corpus(n=args.n_grids, seed=args.seed)
+    starter = None if args.no_starter else load_starter(args.starter)
+    results = run_benchmarks(grids, get_benchmarks(starter), repeats=args.repeats, name_filter=args.filter)
+    print_results(results)
+    if args.save:
+        save_results(args.save, results, get_meta(n_grids=args.n_grids, seed=args.seed, repeats=args.repeats))
+    if args.baseline:
+        return check_baseline(results, args.baseline, args.threshold)
+    return 0
+
+
+def solver_command(args):
+    if args.tasks:
+        tasks = load_tasks(args.tasks, solutions_path=args.solutions)
+    else:
+        tasks = make_task_corpus(n=args.n_tasks, seed=args.seed)
+    if args.limit:
+        tasks = tasks[:args.limit]
+    starter = load_starter(args.starter)
+    predict = starter[args.predict]
+    result = benchmark_solver(predict, tasks, top=args.top)
+    if not args.no_stages:
+        result['stages'] = profile_solver_stages(predict, tasks, [arclib.dsl.__file__, str(Path(args.starter))])
+    print_solver_result(result)
+    results = {'solver': result}
+    if args.save:
+        save_results(args.save, results, get_meta(tasks=args.tasks or 'synthetic', n_tasks=len(tasks), seed=args.seed))
+    if args.baseline:
+        return check_baseline(results, args.baseline, args.threshold, keys=(('tasks_per_sec', -1), ('p95_ms', 1)))
+    return 0
+
+
+def add_common_arguments(parser):
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--starter', default=str(STARTER_PATH), help='starter script with the solver')
+    parser.add_argument('--save', help='write results to this json file')
+    parser.add_argument('--baseline', help='json file from --save to compare with, exit code 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.3, help='allowed relative regression')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m arclib.bench')
+    commands = parser.add_subparsers(dest='command', required=True)
+    primitives = commands.add_parser('primitives', help='DSL primitives, detectors and object map extractors')
+    add_common_arguments(primitives)
+    primitives.add_argument('--n-grids', type=int, default=300)
+    primitives.add_argument('--repeats', type=int, default=3)
+    primitives.add_argument('--filter', help='run only benchmarks with this substring in the name')
+    primitives.add_argument('--no-starter', action='store_true', help='skip the extractors of the starter')
+    primitives.set_defaults(func=primitives_command)
+    solver = commands.add_parser('solver', help='end-to-end solver over a task directory or combined json file')
+    add_common_arguments(solver)
+    solver.add_argument('--tasks', help='task directory or combined challenges json, synthetic tasks if not given')
+    solver.add_argument('--solutions', help='solutions json for a combined challenges file')
+    solver.add_argument('--n-tasks', type=int, default=40, help='number of synthetic tasks')
+    solver.add_argument('--limit', type=int, help='use only the first tasks')
+    solver.add_argument('--predict', default='predict_part_types', help='solver function of the starter')
+    solver.add_argument('--top', type=int, default=10, help='number of slowest tasks to show')
+    solver.add_argument('--no-stages', action='store_true', help='skip the profiled run for the stage breakdown')
+    solver.set_defaults(func=solver_command)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import time
+
+
+class Budget:
+    # time (seconds) and step limits for one search, None means no limit
+    # the search sets stage before doing work, so the stage where the budget ran out is kept in stopped_stage
+    def __init__(self, seconds=None, steps=None):
+        self.seconds = seconds
+        self.steps = steps
+        self.start = time.perf_counter()
+        self.n_steps = 0
+        self.stage = None
+        self.exhausted = False
+        self.stopped_stage = None
+        self.best_partial = None
+        self.best_partial_score = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def step(self, n=1):
+        # count n steps of work, returns False once the budget is exhausted
+        if self.exhausted:
+            return False
+        self.n_steps += n
+        if self.steps is not None and self.n_steps > self.steps:
+            self.stop()
+        elif self.seconds is not None and self.elapsed() > self.seconds:
+            self.stop()
+        return not self.exhausted
+
+    def stop(self):
+        self.exhausted = True
+        self.stopped_stage = self.stage
+
+    def record_partial(self, score, value):
+        # keep value with the highest score seen so far (e.g. number of solved train pairs)
+        if score > self.best_partial_score:
+            self.best_partial_score = score
+            self.best_partial = value
@@ -0,0 +1,77 @@
+# content-addressed cache for facts derived from one grid (background, colors, object maps, ...)
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+
+import numpy as np
+
+
+def grid_key(array):
+    # equal grids give equal keys no matter which python object holds them
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(array.tobytes(), digest_size=16).digest()
+    return array.dtype.str, array.shape, digest
+
+
+def freeze(value):
+    # make the arrays of a cached value read-only (in place), also inside lists, tuples and objects
+    # with a freeze method (e.g. Components), so writing into a shared result raises instead of
+    # changing it for every later equal grid
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            freeze(item)
+    elif hasattr(value, 'freeze'):
+        value.freeze()
+    return value
+
+
+class LRUCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.enabled = True
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        if not self.enabled:
+            return compute()
+        if key in self.data:
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+        self.misses += 1
+        value = freeze(compute())
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data), 'maxsize': self.maxsize}
+
+
+grid_cache = LRUCache()
+
+
+def grid_cached(func):
+    # cache func(array, *args, **kwargs) by grid content and the other (hashable) arguments
+    # cached arrays are read-only (see freeze), lists and sets are copied on return, so callers
+    # can not change the cached value; copy an array before writing into it
+    name = func.__module__ + '.' + func.__qualname__
+
+    @wraps(func)
+    def wrapper(array, *args, **kwargs):
+        key = (name, grid_key(array), args, tuple(sorted(kwargs.items())))
+        value = grid_cache.get(key, lambda: func(array, *args, **kwargs))
+        if isinstance(value, (list, set)):
+            value = type(value)(value)
+        return value
+    return wrapper
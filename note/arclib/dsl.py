@@ -1,19 +1,40 @@
 # simple operations that change numpy array
 from collections import Counter
+from collections.abc import Sequence
 from functools import partial
+import copy
 import itertools
 
 import numpy as np
 from skimage.measure import label
+from scipy.ndimage import find_objects
 from scipy.ndimage.morphology import binary_fill_holes
 
+from arclib.cache import grid_cached
+from arclib.trace import traced
+
+
+# grids are stored as GRID_DTYPE arrays, ARC colors are 0..9
+# NO_COLOR marks cells that do not belong to an object (e.g. in colored maps)
+GRID_DTYPE = np.uint8
+NO_COLOR = 255
+
+
+def to_grid(array):
+    return np.asarray(array, dtype=GRID_DTYPE)
+
+
+def grid_to_list(array):
+    # conversion boundary to python ints, e.g. for json and submission strings
+    return np.asarray(array).astype(int).tolist()
+
 
 ### Operation applied to numpy array
 
 def pad(array, size=1, color=0):
     # size in (1, 10), color: int
     shape = array.shape
-    new_array = np.full((shape[0] + 2 * size, shape[1] + 2 * size), color)
+    new_array = np.full((shape[0] + 2 * size, shape[1] + 2 * size), color, dtype=array.dtype)
     new_array[size:-size, size:-size] = array
     return new_array
 
@@ -26,33 +47,35 @@ def recolor(array, old_color, new_color):
 
 def crop_without_bg(array, bg_color):
     # crop rectangle with content
-    array_ = array.copy()
-    mask = (array_ != bg_color).astype(int)
-    args = np.argwhere(mask > 0)
+    args = np.argwhere(array != bg_color)
     axis0_min = np.min(args, axis=0)[0]
     axis1_min = np.min(args, axis=0)[1]
     axis0_max = np.max(args, axis=0)[0]
     axis1_max = np.max(args, axis=0)[1]
-    array_ = array_[axis0_min: axis0_max + 1, axis1_min: axis1_max + 1]
+    array_ = array[axis0_min: axis0_max + 1, axis1_min: axis1_max + 1].copy()
     return array_
 
 
+@traced(category='augment')
 def repeat(array, n0, n1):
     # n0 in range(2, 10)
     # n1 in range(2, 10)
     return np.tile(array, (n0, n1))
 
 
+@traced(category='augment')
 def rotate(array, angle=1):
     # angle in (1,2,3)
     return np.rot90(array, angle)
 
 
+@traced(category='augment')
 def flip(array, axis=0):
     # axis in (0, 1)
     return np.flip(array, axis)
 
 
+@traced(category='augment')
 def flip_diagonal(array, axis=0):
     # axis in (0, 1)
     if axis == 0:
@@ -63,22 +86,20 @@ def flip_diagonal(array, axis=0):
 
 def repeat_map(array, map):
     # map consists from 0 and 1
-    k = array.shape[0]
-    l = array.shape[1]
-    shape = (map.shape[0] * k, map.shape[1] * l)
-    array_ = np.zeros(shape)
-    for i in range(map.shape[0]):
-        for j in range(map.shape[1]):
-            if map[i, j] == 1:
-                array_[i * k : (i + 1) * k, j * l : (j + 1) * l] = array
-    return array_
+    # tile (i, j) of the result is array where map[i, j] == 1 and zeros elsewhere
+    k, l = array.shape
+    m0, m1 = map.shape
+    array_ = np.where((map == 1)[:, None, :, None], array[None, :, None, :], 0).astype(array.dtype)
+    return array_.reshape(m0 * k, m1 * l)
 
 
+@traced(category='augment')
 def zoom(array, n0, n1):
-    array_ = np.kron(array, np.ones((n0, n1)))
+    array_ = np.kron(array, np.ones((n0, n1), dtype=array.dtype))
     return array_
 
 
+@traced(category='augment')
 def identity(array):
     return array
 
@@ -87,14 +108,10 @@ def identity(array):
 
 
 def reverse_zoom(array, n0, n1):
-    shape = array.shape
-    k0 = shape[0] // n0
-    k1 = shape[1] // n1
-    array_ = np.empty((k0, k1))
-    for i in range(k0):
-        for j in range(k1):
-            array_[i, j] = array[i * n0, j * n1]
-    return array_
+    # top left cell of every (n0, n1) block
+    k0 = array.shape[0] // n0
+    k1 = array.shape[1] // n1
+    return array[: k0 * n0: n0, : k1 * n1: n1].copy()
 
 
 def reverse_repeat(array, n0, n1):
@@ -104,6 +121,95 @@ def reverse_repeat(array, n0, n1):
     return array[:k0, : k1]
 
 
+### Batched operations, stack is 3-D array of same shape grids (axis 0 - grid index)
+
+def stack_grids(grids):
+    return np.stack(grids)
+
+
+def pad_grids(grids, color=NO_COLOR):
+    # stack of grids of different shapes padded at the bottom and right side with color
+    # returns the stack and the shape of every grid
+    shapes = np.array([grid.shape for grid in grids])
+    s0, s1 = shapes.max(axis=0)
+    stack = np.full((len(grids), s0, s1), color, dtype=np.result_type(*grids))
+    for i, grid in enumerate(grids):
+        stack[i, :grid.shape[0], :grid.shape[1]] = grid
+    return stack, shapes
+
+
+def bucket_grids_by_shape(grids):
+    # {shape: (indices of grids, stack of grids)}
+    indices = {}
+    for i, grid in enumerate(grids):
+        indices.setdefault(grid.shape, []).append(i)
+    return {shape: (idx, np.stack([grids[i] for i in idx])) for shape, idx in indices.items()}
+
+
+def batch_pad(stack, size=1, color=0):
+    return np.pad(stack, ((0, 0), (size, size), (size, size)), constant_values=color)
+
+
+def batch_recolor(stack, old_color, new_color):
+    return np.where(stack == old_color, new_color, stack)
+
+
+def batch_repeat(stack, n0, n1):
+    return np.tile(stack, (1, n0, n1))
+
+
+def batch_rotate(stack, angle=1):
+    return np.rot90(stack, angle, axes=(1, 2))
+
+
+def batch_flip(stack, axis=0):
+    return np.flip(stack, axis + 1)
+
+
+def batch_flip_diagonal(stack, axis=0):
+    if axis == 0:
+        return np.swapaxes(stack, 1, 2)
+    elif axis == 1:
+        return np.rot90(np.flip(stack, 1), 1, axes=(1, 2))
+
+
+def batch_zoom(stack, n0, n1):
+    # same values as zoom, but the dtype of stack is kept
+    return np.repeat(np.repeat(stack, n0, axis=1), n1, axis=2)
+
+
+def batch_identity(stack):
+    return stack
+
+
+batch_funcs = {identity: batch_identity, rotate: batch_rotate, flip: batch_flip, flip_diagonal: batch_flip_diagonal,
+               zoom: batch_zoom, repeat: batch_repeat, recolor: batch_recolor, pad: batch_pad}
+
+
+def get_batch_func(func):
+    # batched version of a dsl function or of its partial
+    if isinstance(func, partial):
+        return partial(batch_funcs[func.func], *func.args, **func.keywords)
+    return batch_funcs[func]
+
+
+def batch_sweep(stack, funcs):
+    # apply every function (e.g. simple_output_process_options) to the whole stack
+    # returns one stack of results per function
+    return [get_batch_func(func)(stack) for func in funcs]
+
+
+def batch_apply(grids, funcs):
+    # apply every function to every grid, one vectorized call per function and grid shape
+    # returns results[i][j] = funcs[i](grids[j])
+    results = [[None] * len(grids) for _ in funcs]
+    for indices, stack in bucket_grids_by_shape(grids).values():
+        for func_results, result_stack in zip(results, batch_sweep(stack, funcs)):
+            for i, result in zip(indices, result_stack):
+                func_results[i] = result
+    return results
+
+
 #### Brute force
 
 range10 = tuple(range(1, 11))
@@ -134,6 +240,75 @@ def get_partials(funcs, param_dicts):
 simple_output_process_options = get_partials(simple_funcs, simple_func_param_dicts)
 reversed_simple_output_process_options = get_partials(reversed_simple_funcs, reversed_simple_func_param_dicts)
 
+### Output invariants of simple functions, known without running them
+
+def same_shape(shape, **params):
+    return shape
+
+
+def swapped_shape(shape, **params):
+    return shape[::-1]
+
+
+def rotated_shape(shape, angle=1):
+    return shape if angle % 2 == 0 else shape[::-1]
+
+
+def multiplied_shape(shape, n0, n1):
+    return shape[0] * n0, shape[1] * n1
+
+
+def divided_shape(shape, n0, n1):
+    return shape[0] // n0, shape[1] // n1
+
+
+shape_funcs = {identity: same_shape, rotate: rotated_shape, flip: same_shape, flip_diagonal: swapped_shape,
+               zoom: multiplied_shape, repeat: multiplied_shape,
+               reverse_zoom: divided_shape, reverse_repeat: divided_shape}
+
+
+def get_output_shape(func, shape):
+    # shape of func(array) for an array of given shape, func is a simple function or its partial
+    params = {}
+    if isinstance(func, partial):
+        func, params = func.func, func.keywords
+    return tuple(shape_funcs[func](tuple(shape), **params))
+
+
+def get_color_count_factor(func):
+    # func(array) has factor times more pixels of every color than array, None if not known
+    params = {}
+    if isinstance(func, partial):
+        func, params = func.func, func.keywords
+    if func in (identity, rotate, flip, flip_diagonal):
+        return 1
+    if func in (zoom, repeat):
+        return params['n0'] * params['n1']
+    return None
+
+
+def get_color_counts(array):
+    # pixel count of every color 0..9, None for arrays with other values
+    if array.dtype.kind not in 'iub' or array.size == 0 or array.min() < 0 or array.max() > 9:
+        return None
+    return np.bincount(array.ravel(), minlength=10)
+
+
+def get_signature(array):
+    return array.shape, get_color_counts(array)
+
+
+def signature_can_match(signature, shape, color_counts, func):
+    # False if func(array) can not be equal to the array with given signature,
+    # array is described only by its shape and color counts
+    target_shape, target_color_counts = signature
+    if get_output_shape(func, shape) != target_shape:
+        return False
+    factor = get_color_count_factor(func)
+    if factor is None or color_counts is None or target_color_counts is None:
+        return True
+    return np.array_equal(color_counts * factor, target_color_counts)
+
 ### Operation detectors
 
 # use output only
@@ -149,61 +324,197 @@ def get_divisors(n):
     return divisors + [n]
 
 
+def get_axis_periodicity(array):
+    # zoom factors and repeat counts of array along axis 0
+    s0 = array.shape[0]
+    same_as_previous = (array[1:] == array[:-1]).all(axis=1)
+    zoom_factors = []
+    repeat_counts = []
+    for n in get_divisors(s0):
+        # zoom - rows inside every group of n rows are equal
+        if same_as_previous[np.arange(1, s0) % n != 0].all():
+            zoom_factors.append(n)
+        # repeat - array is n copies of its first s0 // n rows
+        period = s0 // n
+        if (array[period:] == array[:s0 - period]).all():
+            repeat_counts.append(n)
+    return zoom_factors, repeat_counts
+
+
+@grid_cached
+def get_periodicity(array):
+    # all (n0, n1) such that array is zoom(x, n0, n1) and all (n0, n1) such that array is repeat(x, n0, n1)
+    # both axes are independent, so the pairs are products of per-axis answers; (1, 1) is always included
+    zoom0, repeat0 = get_axis_periodicity(array)
+    zoom1, repeat1 = get_axis_periodicity(array.T)
+    return frozenset(itertools.product(zoom0, zoom1)), frozenset(itertools.product(repeat0, repeat1))
+
+
 def detect_zoom(array, n0, n1):
     s0, s1 = array.shape
-    axis0_divisors = get_divisors(array.shape[0])
-    axis1_divisors = get_divisors(array.shape[1])
-    if n0 not in axis0_divisors:
+    if n0 > s0 or n1 > s1 or s0 % n0 or s1 % n1:
         return False
-    if n1 not in axis1_divisors:
+    if (n0, n1) == (1, 1) or (n0, n1) == (s0, s1):
         return False
-    if n0 == 1 and n1 == 1:
-        return False
-    if n0 == array.shape[0] and n1 == array.shape[1]:
-        return False
-    subarrays = get_equal_shape_subarrays(array, n0, n1)
-    for subarray in subarrays:
-        if len(all_colors(subarray)) != 1:
-            return False
-    return True
+    return (n0, n1) in get_periodicity(array)[0]
 
 
 def detect_repeat(array, n0, n1):
     s0, s1 = array.shape
-    axis0_divisors = get_divisors(s0)
-    axis1_divisors = get_divisors(s1)
-    if n0 not in axis0_divisors:
-        return False
-    if n1 not in axis1_divisors:
+    if n0 > s0 or n1 > s1 or s0 % n0 or s1 % n1:
         return False
-    if n0 == 1 and n1 == 1:
+    if (n0, n1) == (1, 1) or (n0, n1) == (s0, s1):
         return False
-    if n0 == s0 and n1 == s1:
-        return False
-    subarrays = get_equal_shape_subarrays(array, s0 // n0, s1 // n1)
-    if len(unique_arrays(subarrays)) != 1:
-        return False
-    return True
+    return (n0, n1) in get_periodicity(array)[1]
 
 # while doing brute force of simple functions run operation only if detect func returns True
 detect_simple_functions = [detect_true] * 8 + get_partials([detect_zoom], [{'n0': range10, 'n1': range10}]) + get_partials([detect_repeat], [{'n0': range10, 'n1': range10}])
 
 
+def get_feasible_reversed_options(array):
+    # reversed_simple_output_process_options whose detect_simple_functions pass for array,
+    # zoom and repeat parameters are taken from get_periodicity instead of trying all of them
+    zoom_factors, repeat_counts = get_periodicity(array)
+    options = []
+    for option in reversed_simple_output_process_options:
+        if option.func in (reverse_zoom, reverse_repeat):
+            params = (option.keywords['n0'], option.keywords['n1'])
+            if params == (1, 1) or params == array.shape:
+                continue
+            if params not in (zoom_factors if option.func is reverse_zoom else repeat_counts):
+                continue
+        options.append(option)
+    return options
+
+
+def periodicity_can_match(func, array):
+    # False if array can not be equal to func(x) for any x, checked for zoom and repeat partials
+    if not isinstance(func, partial) or func.func not in (zoom, repeat):
+        return True
+    params = (func.keywords['n0'], func.keywords['n1'])
+    zoom_factors, repeat_counts = get_periodicity(array)
+    return params in (zoom_factors if func.func is zoom else repeat_counts)
+
+
 
 ### SKIMAGE OBJECTS
 
-def get_objects_from_map_(object_map, touch='wall'):
+class Components(Sequence):
+    # all objects of one grid stored as a single label image (0 - no object, i - object i - 1)
+    # with per-object bounding boxes and pixel counts; behaves as a list of object maps,
+    # each map is materialized only when it is accessed
+    def __init__(self, labels, n):
+        self.labels = labels
+        self.n = n
+        self.sizes = np.bincount(labels.ravel(), minlength=n + 1)[1:]
+        self.slices = find_objects(labels, max_label=n)
+        self._indices = None
+        self._maps = [None] * n
+        self.frozen = False
+
+    def freeze(self):
+        # read-only labels and object maps, also for maps materialized later (shared through grid_cache)
+        self.frozen = True
+        for array in [self.labels, self.sizes] + (self._indices or []) + [m for m in self._maps if m is not None]:
+            array.setflags(write=False)
+
+    @property
+    def bboxes(self):
+        # (axis0_min, axis0_max, axis1_min, axis1_max) as in get_object_map_min_max
+        return [(s0.start, s0.stop - 1, s1.start, s1.stop - 1) for s0, s1 in self.slices]
+
+    @property
+    def indices(self):
+        # flat indices of object pixels in row-major order
+        if self._indices is None:
+            flat = self.labels.ravel()
+            order = np.argsort(flat, kind='stable')
+            order = order[len(flat) - int(self.sizes.sum()):]
+            self._indices = np.split(order, np.cumsum(self.sizes)[:-1]) if self.n else []
+            if self.frozen:
+                for indices in self._indices:
+                    indices.setflags(write=False)
+        return self._indices
+
+    def mask(self, i):
+        object_map = np.zeros(self.labels.shape, dtype=GRID_DTYPE)
+        box = self.slices[i]
+        object_map[box] = self.labels[box] == i + 1
+        if self.frozen:
+            object_map.setflags(write=False)
+        return object_map
+
+    def maps(self):
+        return [self[i] for i in range(self.n)]
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n))]
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError('component index out of range')
+        if self._maps[i] is None:
+            self._maps[i] = self.mask(i)
+        return self._maps[i]
+
+
+def relabel_components(labels, n, keys):
+    # reorder components stably by keys (one key per component)
+    order = np.argsort(keys, kind='stable')
+    relabel = np.zeros(n + 1, dtype=labels.dtype)
+    relabel[order + 1] = np.arange(1, n + 1)
+    return relabel[labels]
+
+
+def get_connectivity(touch):
     if touch == 'wall':
-        connectivity = 1
+        return 1
     elif touch == 'corner':
-        connectivity = 2
-    label_array, max_label_index = label(object_map, connectivity=connectivity,
+        return 2
+
+
+@traced()
+@grid_cached
+def get_components_from_map_(object_map, touch='wall'):
+    label_array, max_label_index = label(object_map, connectivity=get_connectivity(touch),
                                          background=0, return_num=True)
-    return [(label_array == i).astype(int) for i in range(1, max_label_index + 1)]
+    return Components(label_array, max_label_index)
+
+
+@traced()
+@grid_cached
+def get_components_by_color_(array, touch='wall', bg_color=None):
+    # one labeling pass for all colors: neighbours are connected only if they have the same color
+    # components are ordered by color as in the per-color loop, then by position
+    if bg_color is None:
+        bg_color = detect_bg_(array)
+    color_order = {color: i for i, color in enumerate(all_colors(array) - {bg_color})}
+    label_array, n = label(array, connectivity=get_connectivity(touch),
+                           background=bg_color, return_num=True)
+    if n > 1:
+        _, first_indices = np.unique(label_array.ravel(), return_index=True)
+        first_colors = array.ravel()[first_indices[-n:]]
+        keys = [color_order[color] for color in first_colors.tolist()]
+        label_array = relabel_components(label_array, n, keys)
+    return Components(label_array, n)
+
+
+def get_objects_from_map_(object_map, touch='wall'):
+    return get_components_from_map_(object_map, touch=touch).maps()
+
+
+@grid_cached
+def color_histogram(array):
+    # (colors, color_counts)
+    return np.unique(array, return_counts=True)
 
 
 def get_most_common_array_color(array):
-    colors, color_counts = np.unique(array, return_counts=True)
+    colors, color_counts = color_histogram(array)
     most_common_color = colors[np.argmax(color_counts)]
     return most_common_color
 
@@ -213,18 +524,37 @@ def touchs_boundary(map):
     return sum([s > 0 for s in sums]) >= 3
 
 
+def count_touched_sides(array):
+    # number of sides of array (without corners, as in touchs_boundary) where every value appears
+    side_counts = Counter()
+    for side in (array[0, 1:-1], array[-1, 1:-1], array[1:-1, 0], array[1:-1, -1]):
+        side_counts.update(np.unique(side).tolist())
+    return side_counts
+
+
+@traced()
+@grid_cached
 def detect_bg_(array, how='touch'):
     # TODO: not sure that  i need detect_bg
     if how == 'touch':
+        # last color in the order below with a corner-connected component touching at least 3 sides
         bg = 0
         colors = all_colors(array)
         most_common_color = get_most_common_array_color(array)
-        for color in [most_common_color] + list(colors - {most_common_color}):
-            object_maps = get_objects_from_map_((array == color).astype(int), touch='corner')
-            for object_map in object_maps:
-                if touchs_boundary(object_map):
-                    bg = color
-                    break
+        color_order = [most_common_color] + list(colors - {most_common_color})
+        # a component can touch only the sides its color touches
+        side_counts = count_touched_sides(array)
+        candidates = [color for color in color_order if side_counts[color] >= 3]
+        if not candidates:
+            return bg
+        # one labeling pass over the pixels of all candidate colors
+        label_array = label(np.where(np.isin(array, candidates), array.astype(int) + 1, 0), connectivity=2, background=0)
+        touching_labels = [i for i, count in count_touched_sides(label_array).items() if i > 0 and count >= 3]
+        touching_colors = set(np.unique(array[np.isin(label_array, touching_labels)]).tolist())
+        for color in reversed(candidates):
+            if color in touching_colors:
+                bg = color
+                break
     elif how == 'black':
         bg = 0
     elif how == 'most_common':
@@ -232,37 +562,36 @@ def detect_bg_(array, how='touch'):
     return bg
 
 
+@traced()
+@grid_cached
 def get_objects_by_connectivity_(array, touch='wall', bg_color=None):
     if bg_color is None:
         bg_color = detect_bg_(array)
-    array_map = (array != bg_color).astype(int)
-    object_maps = get_objects_from_map_(array_map, touch=touch)
-    return object_maps
+    return get_components_from_map_(array != bg_color, touch=touch)
 
 
+@traced()
+@grid_cached
 def get_objects_by_color_and_connectivity_(array, touch='wall', bg_color=None):
-    if bg_color is None:
-        bg_color = detect_bg_(array)
-    colors = all_colors(array) - {bg_color}
-    object_maps = []
-    for color in colors:
-        color_object_maps = get_objects_from_map_((array == color).astype(int), touch=touch)
-        object_maps.extend(color_object_maps)
-    return object_maps
+    return get_components_by_color_(array, touch=touch, bg_color=bg_color)
 
 
+@traced()
+@grid_cached
 def get_objects_by_color_(array, bg_color=None):
+    # one object per color, the label of a pixel is the position of its color
     if bg_color is None:
         bg_color = detect_bg_(array)
-    object_maps = []
-    colors = all_colors(array) - {bg_color}
-    for color in colors:
-        object_map = (array == color).astype(int)
-        object_maps.append(object_map)
-    return object_maps
+    colors = list(all_colors(array) - {bg_color})
+    label_array = np.zeros(array.shape, dtype=np.int32)
+    for i, color in enumerate(colors):
+        label_array[array == color] = i + 1
+    return Components(label_array, len(colors))
 
 
 
+@traced()
+@grid_cached
 def get_objects_rectangles(array, direction='vertical', bg_color=None):
     # rectangles of same color can be attached to each other #
     s0, s1 = array.shape
@@ -306,43 +635,69 @@ def get_objects_rectangles(array, direction='vertical', bg_color=None):
             prev_slice = slice
         if np.sum(object_map) != 0:
             object_maps.append(object_map)
-    object_maps = [(object_map > 0).astype(int) for object_map in object_maps]
+    object_maps = [(object_map > 0).astype(GRID_DTYPE) for object_map in object_maps]
     return object_maps
 
 
-def fit_largest_rectangle(object_map):
-    largest_rectangle_map = np.zeros_like(object_map)
+def get_rectangle_heights(object_maps):
+    # heights[..., r, c] - number of consecutive nonzero cells ending at row r in column c
+    # works for one map (2-D) and for a stack of maps (3-D)
+    object_maps = np.asarray(object_maps) != 0
+    heights = np.zeros(object_maps.shape, dtype=int)
+    heights[..., 0, :] = object_maps[..., 0, :]
+    for r in range(1, object_maps.shape[-2]):
+        heights[..., r, :] = (heights[..., r - 1, :] + 1) * object_maps[..., r, :]
+    return heights
+
+
+def get_largest_rectangle(heights):
+    # largest rectangle of ones as (axis0_min, axis1_min, axis0_max, axis1_max), None for empty map
+    # monotonic stack over column heights of every row, O(rows * cols)
+    # among rectangles of the largest area the one with the smallest bottom row, then right column,
+    # then height is chosen (the order in which the former brute force met them)
+    best_area = 0
+    best = None
+    best_key = None
+    for r, row in enumerate(heights.tolist()):
+        row.append(0)
+        stack = []
+        for c, h in enumerate(row):
+            while stack and row[stack[-1]] >= h:
+                j = stack.pop()
+                height = row[j]
+                if height == 0:
+                    continue
+                left = stack[-1] + 1 if stack else 0
+                right = c - 1
+                area = height * (right - left + 1)
+                key = (r, right, height)
+                if area > best_area or (area == best_area and key < best_key):
+                    best_key = key
+                    best_area = area
+                    best = (r - height + 1, left, r, right)
+            stack.append(c)
+    return best
 
-    nrows, ncols = object_map.shape
-    skip = 0
-    area_max = (0, [])
 
-    a = object_map
-    w = np.zeros(dtype=int, shape=a.shape)
-    h = np.zeros(dtype=int, shape=a.shape)
-    for r in range(nrows):
-        for c in range(ncols):
-            if a[r][c] == skip:
-                continue
-            if r == 0:
-                h[r][c] = 1
-            else:
-                h[r][c] = h[r - 1][c] + 1
-            if c == 0:
-                w[r][c] = 1
-            else:
-                w[r][c] = w[r][c - 1] + 1
-            minw = w[r][c]
-            for dh in range(h[r][c]):
-                minw = min(minw, w[r - dh][c])
-                area = (dh + 1) * minw
-                if area > area_max[0]:
-                    area_max = (area, [(r - dh, c - minw + 1, r, c)])
-    axis0_min, axis1_min, axis0_max, axis1_max = area_max[1][0]
+def fit_largest_rectangle(object_map):
+    largest_rectangle_map = np.zeros_like(object_map)
+    axis0_min, axis1_min, axis0_max, axis1_max = get_largest_rectangle(get_rectangle_heights(object_map))
     largest_rectangle_map[axis0_min: axis0_max + 1, axis1_min: axis1_max + 1] = 1
     return largest_rectangle_map
 
 
+def fit_largest_rectangles(object_maps):
+    # fit_largest_rectangle for all object maps of one grid, heights are computed for all maps at once
+    if len(object_maps) == 0:
+        return []
+    stack = np.stack(object_maps)
+    rectangle_maps = np.zeros_like(stack)
+    for rectangle_map, heights in zip(rectangle_maps, get_rectangle_heights(stack)):
+        axis0_min, axis1_min, axis0_max, axis1_max = get_largest_rectangle(heights)
+        rectangle_map[axis0_min: axis0_max + 1, axis1_min: axis1_max + 1] = 1
+    return list(rectangle_maps)
+
+
 def remove_padding(object_map):
     axis0_min, axis0_max, axis1_min, axis1_max = get_object_map_min_max(object_map)
     object_map_ = np.zeros_like(object_map)
@@ -350,33 +705,37 @@ def remove_padding(object_map):
     return object_map_
 
 
+@traced()
+@grid_cached
 def get_objects_rectangles_without_noise(array, bg_color=None):
     # get rectangle objects out of noisy background
     object_maps = get_objects_by_color_and_connectivity_(array, touch='wall', bg_color=bg_color)
     object_maps = [object_map for object_map in object_maps if np.count_nonzero(object_map) > 1]
-    object_maps = [binary_fill_holes(object_map).astype(int) for object_map in object_maps]
-    object_maps = [fit_largest_rectangle(object_map) for object_map in object_maps]
+    object_maps = [binary_fill_holes(object_map).astype(GRID_DTYPE) for object_map in object_maps]
+    object_maps = fit_largest_rectangles(object_maps)
     return object_maps
 
 
+@traced()
+@grid_cached
 def get_objects_rectangles_without_noise_without_padding(array, bg_color=None):
     object_maps = get_objects_rectangles_without_noise(array, bg_color=bg_color)
     object_maps = [remove_padding(object_map) for object_map in object_maps]
     return object_maps
 
 
+def get_tiles(array, l0, l1):
+    # zero-copy 4-D view, tiles[i, j] = array[i * l0: (i + 1) * l0, j * l1: (j + 1) * l1]
+    # rows and columns that do not fill a whole tile are dropped
+    n0 = array.shape[0] // l0
+    n1 = array.shape[1] // l1
+    return array[: n0 * l0, : n1 * l1].reshape(n0, l0, n1, l1).swapaxes(1, 2)
+
+
 def get_equal_shape_subarrays(array, l0, l1):
     # (l0, l1) - shape of subarrays
     # untile operations but parameters are dimensions of new array
-    subarrays = []
-    s0, s1 = array.shape
-    n0 = s0 // l0
-    n1 = s1 // l1
-    for i in range(n0):
-        for j in range(n1):
-            subarray = array[i * l0: (i + 1) * l0, j * l1 : (j + 1) * l1]
-            subarrays.append(subarray)
-    return subarrays
+    return [tile for row in get_tiles(array, l0, l1) for tile in row]
 
 
 def get_object_parts(object_map):
@@ -399,7 +758,7 @@ def get_object_parts(object_map):
             args_max = np.max(args)
             border_map[args_min, j] = 1
             border_map[args_max, j] = 1
-    inner_map = (object_map != border_map).astype(int)
+    inner_map = (object_map != border_map).astype(GRID_DTYPE)
     return border_map, inner_map
 
 
@@ -420,7 +779,7 @@ def get_cropped_map(object_map):
 
 def get_colored_map(array, object_map):
     colored_map = array.copy()
-    colored_map[object_map == 0] = -1
+    colored_map[object_map == 0] = NO_COLOR
     return colored_map
 
 
@@ -441,7 +800,7 @@ def get_object_dimensions(object_map):
 
 
 def get_object_size(object_map):
-    return np.sum(object_map)
+    return int(np.count_nonzero(object_map))
 
 
 def get_most_common_color(array, object_map):
@@ -471,25 +830,139 @@ def is_rectangle(object_map):
 ### Object class
 
 
+class lazy_attribute:
+    # read-only attribute computed on first access and kept in the slot '_' + name
+    def __init__(self, func):
+        self.func = func
+        self.slot = '_' + func.__name__
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self.func(obj)
+            setattr(obj, self.slot, value)
+            return value
+
+
 class BaseObject:
     #  object without nested objects
-    def __init__(self, array, object_map):
+    # features are computed on first access, crops are views of the bounding box of the object
+    __slots__ = ('array', 'object_map', '_bbox', '_box', '_rectangle_map', '_colored_map', '_cropped_map',
+                 '_cropped_object', '_size', '_is_rectangle', '_color_stats', '_most_common_color',
+                 '_least_common_color')
+
+    def __init__(self, array, object_map, bbox=None):
+        # bbox - (axis0_min, axis0_max, axis1_min, axis1_max), computed from object_map if not given
         self.array = array
         self.object_map = object_map
-        self.rectangle_map = get_rectangle_map(object_map)
-        self.colored_map = get_colored_map(array, object_map)
-        self.cropped_map = get_cropped_map(object_map)
-        self.cropped_object = crop_without_bg(self.colored_map, bg_color=-1) # bg_color=-1
-        self.size = get_object_size(object_map)
-        self.height, self.width = self.cropped_map.shape
-        self.area = self.height * self.width
-        self.is_rectangle = is_rectangle(object_map)
-        self.colors, self.color_counts = np.unique(array[object_map == 1], return_counts=True)
-        self.n_colors = len(self.colors)
-        #self.unique_colors = set(self.colors)
-        self.most_common_color = self.colors[np.argmax(self.color_counts)]
-        self.least_common_color = self.colors[np.argmin(self.color_counts)]
-        self.axis0_min, self.axis0_max, self.axis1_min, self.axis1_max = get_object_map_min_max(self.object_map)
+        if bbox is not None:
+            self._bbox = tuple(bbox)
+
+    @lazy_attribute
+    def bbox(self):
+        return get_object_map_min_max(self.object_map)
+
+    @lazy_attribute
+    def box(self):
+        axis0_min, axis0_max, axis1_min, axis1_max = self.bbox
+        return slice(axis0_min, axis0_max + 1), slice(axis1_min, axis1_max + 1)
+
+    @property
+    def axis0_min(self):
+        return self.bbox[0]
+
+    @property
+    def axis0_max(self):
+        return self.bbox[1]
+
+    @property
+    def axis1_min(self):
+        return self.bbox[2]
+
+    @property
+    def axis1_max(self):
+        return self.bbox[3]
+
+    @lazy_attribute
+    def rectangle_map(self):
+        rectangle_map = np.zeros_like(self.object_map)
+        rectangle_map[self.box] = 1
+        return rectangle_map
+
+    @lazy_attribute
+    def colored_map(self):
+        return get_colored_map(self.array, self.object_map)
+
+    @lazy_attribute
+    def cropped_map(self):
+        return self.object_map[self.box]
+
+    @lazy_attribute
+    def cropped_object(self):
+        cropped_object = self.array[self.box].copy()
+        cropped_object[self.cropped_map == 0] = NO_COLOR
+        return cropped_object
+
+    @lazy_attribute
+    def size(self):
+        return get_object_size(self.cropped_map)
+
+    @property
+    def height(self):
+        return self.bbox[1] - self.bbox[0] + 1
+
+    @property
+    def width(self):
+        return self.bbox[3] - self.bbox[2] + 1
+
+    @property
+    def area(self):
+        return self.height * self.width
+
+    @lazy_attribute
+    def is_rectangle(self):
+        return bool(self.size == self.area)
+
+    @lazy_attribute
+    def color_stats(self):
+        # (colors, color_counts) of the object pixels
+        return np.unique(self.array[self.box][self.cropped_map == 1], return_counts=True)
+
+    @property
+    def colors(self):
+        return self.color_stats[0]
+
+    @property
+    def color_counts(self):
+        return self.color_stats[1]
+
+    @property
+    def n_colors(self):
+        return len(self.colors)
+
+    @lazy_attribute
+    def most_common_color(self):
+        return self.colors[np.argmax(self.color_counts)]
+
+    @lazy_attribute
+    def least_common_color(self):
+        return self.colors[np.argmin(self.color_counts)]
+
+    def feature_dict(self, names=None):
+        # features with given names (all feature_names the object has by default) in one dictionary,
+        # only these features are computed
+        if names is None:
+            names = [name for name in feature_names if hasattr(type(self), name)]
+        feature_dict_ = {}
+        for name in names:
+            value = getattr(self, name)
+            if type(value) == np.ndarray:
+                value = array_to_tuple(value)
+            feature_dict_[name] = value
+        return feature_dict_
 
 
 exclude_feature_names = ['array', 'nested_object', 'nested_objects', 'color_counts', 'object_map', 'colored_map']
@@ -502,66 +975,93 @@ feature_names = min_max_feature_names + ['cropped_map', 'cropped_object', 'is_re
 
 class Object(BaseObject):
     # object with nested objects
-    def __init__(self, array, object_map):
-        super().__init__(array, object_map)
-        self.nested_objects = make_base_objects(array, get_nested_objects(array, object_map))
-        self.nested_objects_count = len(self.nested_objects)
-        if len(set(np.unique(self.colored_map)) - {-1}) > 1: # nested object exists
-            self.nested_object = BaseObject(array, get_nested_object(array, object_map, self.most_common_color))
-            self.nested_object_size = self.nested_object.size
-            self.nested_object_shape = self.nested_object.cropped_map
-            self.nested_object_most_common_color = self.nested_object.most_common_color
-        else:
-            self.nested_object = None
-            self.nested_object_size = None
-            self.nested_object_shape = None
-            self.nested_object_most_common_color = None
-
-    def feature_dict(self):
-        # all object features in one dictionary
-        feature_dict_ = {}
-        for attr, value in self.__dict__.items():
-            if attr in feature_names:
-                if type(value) == np.ndarray:
-                    value_ = array_to_tuple(value)
-                else:
-                    value_ = value
-                feature_dict_[attr] = value_
-        return feature_dict_
+    __slots__ = ('_nested_objects', '_nested_object')
+
+    @lazy_attribute
+    def nested_objects(self):
+        return make_base_objects(self.array, get_nested_objects(self.array, self.object_map))
+
+    @property
+    def nested_objects_count(self):
+        return len(self.nested_objects)
+
+    @lazy_attribute
+    def nested_object(self):
+        if self.n_colors > 1: # nested object exists
+            return BaseObject(self.array, get_nested_object(self.array, self.object_map, self.most_common_color))
+        return None
+
+    @property
+    def nested_object_size(self):
+        return None if self.nested_object is None else self.nested_object.size
+
+    @property
+    def nested_object_shape(self):
+        return None if self.nested_object is None else self.nested_object.cropped_map
+
+    @property
+    def nested_object_most_common_color(self):
+        return None if self.nested_object is None else self.nested_object.most_common_color
+
+
+def get_object_maps_shapes(object_maps):
+    # bounding box shapes of all non-empty object maps
+    if isinstance(object_maps, Components):
+        return [(s0.stop - s0.start, s1.stop - s1.start) for s0, s1 in object_maps.slices]
+    return [get_object_dimensions(object_map) for object_map in object_maps if np.count_nonzero(object_map) > 0]
+
+
+def get_object_maps_bboxes(object_maps):
+    # bounding boxes come for free with Components, otherwise they are computed from every map
+    if isinstance(object_maps, Components):
+        return object_maps.bboxes
+    return [get_object_map_min_max(object_map) for object_map in object_maps]
 
 
 def make_objects(array, object_maps):
-    return [Object(array, object_map) for object_map in object_maps]
+    bboxes = get_object_maps_bboxes(object_maps)
+    return [Object(array, object_map, bbox) for object_map, bbox in zip(object_maps, bboxes)]
 
 
 def make_base_objects(array, object_maps):
-    return [BaseObject(array, object_map) for object_map in object_maps]
+    bboxes = get_object_maps_bboxes(object_maps)
+    return [BaseObject(array, object_map, bbox) for object_map, bbox in zip(object_maps, bboxes)]
 
 
 def get_nested_objects(array, object_map):
     # get all nested objects separately
     array_ = array.copy()
-    array_[object_map == 0] = -1
-    nested_object_maps = get_objects_by_color_and_connectivity_(array_, touch='wall', bg_color=-1)
+    array_[object_map == 0] = NO_COLOR
+    nested_object_maps = get_objects_by_color_and_connectivity_(array_, touch='wall', bg_color=NO_COLOR)
     return nested_object_maps
 
 
 def get_nested_object(array, object_map, most_common_color):
     # get all nested objects all together even if they are not connected
     # exclude most common color
-    array_ = array.copy()
-    array_[object_map == 0] = -1
-    array_[array_ == most_common_color] = -1
-    array_[array_ >= 0] = 1
-    array_[array_ == -1] = 0
-    nested_object_map = array_ #get_objects_by_color_(array_, bg_color=-1)[0]
+    nested_object_map = ((object_map != 0) & (array != most_common_color)).astype(GRID_DTYPE)
     return nested_object_map
 
 
 # Task class and color functions
+TASK_GRID_FIELDS = ('inputs', 'outputs', 'test_inputs', 'test_outputs', 'pairs', 'test_pairs')
+
+
+def read_only_view(value):
+    # read-only views of the arrays (no copy, the arrays themselves stay writable), lists become tuples
+    if isinstance(value, np.ndarray):
+        view = value.view()
+        view.setflags(write=False)
+        return view
+    if isinstance(value, (list, tuple)):
+        return tuple(read_only_view(item) for item in value)
+    return value
+
+
 class Task():
-    def __init__(self, task, idx=None):
+    def __init__(self, task, idx=None, task_id=None):
         self.task = task
+        self.task_id = task_id
         self.inputs = get_inputs(task)
         self.outputs = get_outputs(task)
         self.test_inputs = get_test_inputs(task)
@@ -570,6 +1070,30 @@ class Task():
         self.pairs = get_pairs(task)
         self.idx = idx
 
+    def replace(self, **fields):
+        # copy-on-write view: given fields are replaced, the rest (and the raw task dict) is shared with
+        # this task, the view holds tuples of read-only views of the grids, so it can not change this
+        # task in place and this task is left as it is
+        task = copy.copy(self)
+        task.__dict__.update(fields)
+        for field in TASK_GRID_FIELDS:
+            grids = getattr(task, field)
+            if grids is not None:
+                setattr(task, field, read_only_view(grids))
+        return task
+
+
+def bucket_task_grids(task):
+    # all task grids bucketed by shape: {shape: (keys, stack)}, key is (field, index)
+    # with field in ('inputs', 'outputs', 'test_inputs', 'test_outputs')
+    keys = []
+    grids = []
+    for field in ('inputs', 'outputs', 'test_inputs', 'test_outputs'):
+        for i, grid in enumerate(getattr(task, field) or []):
+            keys.append((field, i))
+            grids.append(grid)
+    return {shape: ([keys[i] for i in indices], stack) for shape, (indices, stack) in bucket_grids_by_shape(grids).items()}
+
 
 def flatten_list(pred):
     return [p for row in pred for p in row]
@@ -578,32 +1102,32 @@ def flatten_list(pred):
 def get_outputs(task):
     train_examples = task['train']
     outputs = [ex['output'] for ex in train_examples]
-    outputs = [np.array(output) for output in outputs]
+    outputs = [to_grid(output) for output in outputs]
     return outputs
 
 
 def get_inputs(task):
     train_examples = task['train']
     inputs = [ex['input'] for ex in train_examples]
-    inputs = [np.array(input) for input in inputs]
+    inputs = [to_grid(input) for input in inputs]
     return inputs
 
 
 def get_pairs(task):
     train_examples = task['train']
-    pairs = [(np.array(ex['input']), np.array(ex['output'])) for ex in train_examples]
+    pairs = [(to_grid(ex['input']), to_grid(ex['output'])) for ex in train_examples]
     return pairs
 
 
 def get_test_inputs(task):
     test = task['test']
-    return [np.array(ex['input']) for ex in test]
+    return [to_grid(ex['input']) for ex in test]
 
 
 def get_test_outputs(task):
     test = task['test']
     if 'output' in test[0].keys():
-        return [np.array(ex['output']) for ex in test]
+        return [to_grid(ex['output']) for ex in test]
     else:
         return None
 
@@ -611,7 +1135,7 @@ def get_test_outputs(task):
 def get_test_pairs(task):
     test = task['test']
     if 'output' in test[0].keys():
-        return [(np.array(ex['input']), np.array(ex['output'])) for ex in test]
+        return [(to_grid(ex['input']), to_grid(ex['output'])) for ex in test]
     else:
         return None
 
@@ -621,6 +1145,7 @@ def colors(array):
     return colors
 
 
+@grid_cached
 def all_colors(array):
     colors = set(flatten_list(array))
     return colors
@@ -634,15 +1159,60 @@ def array_to_tuple(array):
     return res
 
 
+def array_key(array):
+    # hashable key of array values: equal arrays give equal keys whatever their dtype (1 == 1.0),
+    # values are stored in the smallest exact dtype so the key does not depend on the input dtype
+    array = np.asarray(array)
+    if array.dtype.kind == 'f' and np.isfinite(array).all() and (array == np.round(array)).all():
+        array = array.astype(np.int64)
+    if array.dtype.kind in 'biu':
+        if array.size == 0 or (array.min() >= 0 and array.max() <= 255):
+            return 'u1', array.shape, array.astype(np.uint8).tobytes()
+        return 'i8', array.shape, array.astype(np.int64).tobytes()
+    return array.dtype.str, array.shape, np.ascontiguousarray(array).tobytes()
+
+
+class ArraySet:
+    # set of arrays with O(1) membership check by array_key,
+    # keeps the first added array of every value as it was given
+    def __init__(self, arrays=()):
+        self.arrays = {}
+        for array in arrays:
+            self.add(array)
+
+    def add(self, array):
+        self.arrays.setdefault(array_key(array), array)
+
+    def __contains__(self, array):
+        return array_key(array) in self.arrays
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def __iter__(self):
+        return iter(self.arrays.values())
+
+
+def contains_array(arrays, array):
+    # single membership check: arrays of another shape are skipped without hashing, the rest are
+    # compared with array in one vectorized pass, an ArraySet is used as it is
+    if isinstance(arrays, ArraySet):
+        return array in arrays
+    array = np.asarray(array)
+    same_shape = [a for a in arrays if np.shape(a) == array.shape]
+    if not same_shape:
+        return False
+    return bool((np.stack(same_shape) == array).reshape(len(same_shape), -1).all(axis=1).any())
+
+
+@traced()
 def unique_arrays(arrays):
-    arrays = [array_to_tuple(a) for a in arrays]
-    arrays = list(set(arrays))
-    arrays = [np.array(a) for a in arrays]
-    return arrays
+    # unique arrays in order of first appearance
+    return list(ArraySet(arrays))
 
 
 def all_task_colors(task):
-    arrays = task.inputs + task.outputs + task.test_inputs
+    arrays = [*task.inputs, *task.outputs, *task.test_inputs]
     colors = set(flatten_list([all_colors(array) for array in arrays]))
     return colors
 
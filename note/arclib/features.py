@@ -0,0 +1,176 @@
+# columnar object features: all objects of a grid, task or dataset in one table,
+# one numpy array per feature, so selection rules are vectorized reductions over grids
+import numpy as np
+
+from arclib.dsl import make_objects, detect_bg_, array_key, min_max_feature_names
+
+# features stored as dense ids of their (array) value, -1 for None
+shape_feature_names = ['cropped_map', 'cropped_object', 'nested_object_shape']
+# features stored as int, -1 for None
+color_feature_names = ['most_common_color', 'least_common_color', 'nested_object_most_common_color']
+flag_feature_names = ['is_rectangle']
+table_feature_names = min_max_feature_names + shape_feature_names + color_feature_names + flag_feature_names
+
+
+class ArrayIds:
+    # dense integer id for every distinct array value, -1 for None
+    def __init__(self):
+        self.ids = {}
+        self.arrays = []
+
+    def __call__(self, array):
+        if array is None:
+            return -1
+        key = array_key(array)
+        if key not in self.ids:
+            self.ids[key] = len(self.arrays)
+            self.arrays.append(array)
+        return self.ids[key]
+
+
+class ObjectTable:
+    # one row per object, objects of one grid are contiguous rows
+    # numeric features (min_max_feature_names) are float columns with nan for None
+    def __init__(self, objects_list, grid_keys=None, names=None, array_ids=None):
+        # objects_list - list of object lists, one per grid
+        # array_ids - shared ArrayIds to keep shape ids comparable between tables
+        if names is None:
+            names = table_feature_names
+        self.grid_keys = list(range(len(objects_list))) if grid_keys is None else list(grid_keys)
+        self.grid_counts = np.array([len(objects) for objects in objects_list], dtype=int)
+        self.grid_starts = np.cumsum(self.grid_counts) - self.grid_counts
+        self.grid_index = np.repeat(np.arange(len(objects_list)), self.grid_counts)
+        self.objects = [obj for objects in objects_list for obj in objects]
+        self.array_ids = ArrayIds() if array_ids is None else array_ids
+        self.columns = {name: self.make_column(name, [getattr(obj, name) for obj in self.objects]) for name in names}
+
+    def make_column(self, name, values):
+        if name in shape_feature_names:
+            return np.array([self.array_ids(value) for value in values], dtype=int)
+        if name in color_feature_names:
+            return np.array([-1 if value is None else value for value in values], dtype=int)
+        if name in flag_feature_names:
+            return np.array(values, dtype=bool)
+        return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def grid_rows(self, grid):
+        # rows of the objects of grid number grid
+        start = self.grid_starts[grid]
+        return np.arange(start, start + self.grid_counts[grid])
+
+    def argbest(self, name, how='max'):
+        # row of the object with the largest (how='max') or smallest (how='min') value in every grid,
+        # the first such object on ties, -1 for grids without objects or values
+        values = self.columns[name].astype(float)
+        if how == 'min':
+            values = -values
+        values = np.where(np.isnan(values), -np.inf, values)
+        rows = np.full(len(self.grid_counts), -1, dtype=int)
+        nonempty = np.flatnonzero(self.grid_counts > 0)
+        if len(nonempty) == 0:
+            return rows
+        grid_max = np.full(len(self.grid_counts), -np.inf)
+        grid_max[nonempty] = np.maximum.reduceat(values, self.grid_starts[nonempty])
+        best = np.flatnonzero((values == grid_max[self.grid_index]) & np.isfinite(values))
+        grids, first = np.unique(self.grid_index[best], return_index=True)
+        rows[grids] = best[first]
+        return rows
+
+    def has_value(self, name):
+        # False for objects where feature name is None
+        values = self.columns[name]
+        if values.dtype.kind == 'f':
+            return ~np.isnan(values)
+        if values.dtype.kind == 'b':
+            return np.ones(len(values), dtype=bool)
+        return values != -1
+
+    def is_unique(self, name):
+        # True for objects whose value of feature name is not shared by other objects of their grid
+        values = self.columns[name]
+        if len(values) == 0:
+            return np.zeros(0, dtype=bool)
+        pairs = np.stack([self.grid_index.astype(float), values.astype(float)], axis=1)
+        _, inverse, counts = np.unique(pairs, axis=0, return_inverse=True, return_counts=True)
+        return counts[inverse.ravel()] == 1
+
+
+def get_grid_object_table(array, object_maps, names=None):
+    return ObjectTable([make_objects(array, object_maps)], names=names)
+
+
+def get_task_objects(task, get_object_maps, fields=('inputs', 'test_inputs')):
+    # (keys, objects_list) for all grids of given task fields, key is (field, index)
+    keys = []
+    objects_list = []
+    for field in fields:
+        for i, grid in enumerate(getattr(task, field) or []):
+            object_maps = get_object_maps(grid, bg_color=detect_bg_(grid))
+            keys.append((field, i))
+            objects_list.append(make_objects(grid, object_maps))
+    return keys, objects_list
+
+
+def get_task_object_table(task, get_object_maps, names=None, fields=('inputs', 'test_inputs')):
+    keys, objects_list = get_task_objects(task, get_object_maps, fields=fields)
+    return ObjectTable(objects_list, grid_keys=keys, names=names)
+
+
+def get_dataset_object_table(tasks, get_object_maps, names=None, fields=('inputs', 'test_inputs')):
+    # one table for all tasks, key is (task number, field, index)
+    keys = []
+    objects_list = []
+    for n, task in enumerate(tasks):
+        task_keys, task_objects_list = get_task_objects(task, get_object_maps, fields=fields)
+        keys.extend((n,) + key for key in task_keys)
+        objects_list.extend(task_objects_list)
+    return ObjectTable(objects_list, grid_keys=keys, names=names)
+
+
+### Object selectors learned from train pairs
+
+# (how, name): the object with the largest / smallest value or the only object with its value in the grid
+object_selectors = ([('max', name) for name in min_max_feature_names] + [('min', name) for name in min_max_feature_names]
+                    + [('unique', name) for name in table_feature_names])
+
+
+def select_rows(table, selector):
+    # row chosen by selector in every grid of table, -1 where it chooses nothing
+    how, name = selector
+    if how in ('max', 'min'):
+        return table.argbest(name, how)
+    selected = np.flatnonzero(table.is_unique(name) & table.has_value(name))
+    counts = np.bincount(table.grid_index[selected], minlength=len(table.grid_counts))
+    rows = np.full(len(table.grid_counts), -1, dtype=int)
+    rows[table.grid_index[selected]] = selected
+    rows[counts != 1] = -1
+    return rows
+
+
+def learn_selectors(table, correct, selectors=object_selectors):
+    # selectors that choose a correct object in every grid of table,
+    # correct - bool array with True for the rows of objects giving the expected output
+    learned = []
+    for selector in selectors:
+        if selector[1] not in table.columns:
+            continue
+        rows = select_rows(table, selector)
+        if (rows >= 0).all() and correct[rows].all():
+            learned.append(selector)
+    return learned
+
+
+def rank_selected_rows(table, selectors, grid=0):
+    # rows of grid chosen by any of selectors, most often chosen first
+    votes = {}
+    for selector in selectors:
+        row = select_rows(table, selector)[grid]
+        if row >= 0:
+            votes[row] = votes.get(row, 0) + 1
+    return sorted(votes, key=lambda row: -votes[row])
@@ -0,0 +1,189 @@
+# pipelined run over tasks: load -> solve -> write
+# a loader thread parses tasks ahead of the solver, tasks are solved in the calling thread (n_jobs=1,
+# so solve_task timeouts keep working) or in a process pool, and a writer thread hands the results
+# to write in the order of tasks
+# both queues hold at most max_pending items: loading stops while max_pending tasks wait to be solved,
+# solving stops while max_pending results wait to be written (use max_pending >= n_jobs)
+# a dead worker (os._exit, segfault, out of memory) breaks the pool, the unfinished tasks of a broken
+# pool are solved again one at a time in a fresh single-worker pool (as in util.run_in_process_pool),
+# so only the task that kills the worker again gets an error (see worker_died)
+# with n_jobs != 1 the tracer and grid_cache record in the worker processes, not in the caller
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import os
+import queue
+import threading
+import time
+
+from arclib.util import solve_task
+
+DONE = object()
+
+
+def worker_died(error):
+    # the worker process of the task died, the task can be solved again in a later run
+    return error is not None and error.startswith('BrokenProcessPool')
+
+
+class RetryPool:
+    # solves tasks one at a time in a single-worker pool, a new pool after every dead worker
+    def __init__(self, solve):
+        self.solve = solve
+        self.executor = None
+
+    def __call__(self, task):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=1)
+        try:
+            return self.executor.submit(self.solve, task).result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self.shutdown()
+            return [], 0., repr(e)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class StageStats:
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.
+        self.waiting = 0.  # seconds waiting for input from the previous stage
+        self.blocked = 0.  # seconds waiting for room in the queue to the next stage
+
+    def summary(self, wall):
+        utilization = self.busy / (wall * self.workers) if wall > 0 else 0.
+        return {'items': self.items, 'busy': self.busy, 'waiting': self.waiting, 'blocked': self.blocked,
+                'utilization': utilization}
+
+
+def timed_get(q, stats):
+    start = time.perf_counter()
+    item = q.get()
+    stats.waiting += time.perf_counter() - start
+    return item
+
+
+def timed_put(q, item, stats):
+    start = time.perf_counter()
+    q.put(item)
+    stats.blocked += time.perf_counter() - start
+
+
+def load_stage(tasks, load_queue, stats, errors):
+    try:
+        tasks = iter(tasks)
+        while True:
+            start = time.perf_counter()
+            task = next(tasks, DONE)
+            if task is DONE:
+                break
+            stats.busy += time.perf_counter() - start
+            stats.items += 1
+            timed_put(load_queue, task, stats)
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        load_queue.put(DONE)
+
+
+def write_stage(write, write_queue, stats, solve_stats, stop, errors, retry):
+    # after an error or stop only the results that are already finished are written, the rest is drained
+    # retry(task) solves the tasks of a broken pool again
+    while True:
+        item = timed_get(write_queue, stats)
+        if item is DONE:
+            break
+        task, future = item
+        if errors or (stop.is_set() and not future.done()):
+            continue
+        start = time.perf_counter()
+        try:
+            preds, seconds, error = future.result()
+        except BrokenProcessPool:
+            if stop.is_set():
+                continue
+            preds, seconds, error = retry(task)
+        except Exception as e:
+            # e.g. the result could not be sent back
+            preds, seconds, error = [], 0., repr(e)
+        stats.waiting += time.perf_counter() - start
+        solve_stats.busy += seconds
+        solve_stats.items += 1
+        start = time.perf_counter()
+        try:
+            write(task, preds, seconds, error)
+        except BaseException as e:
+            errors.append(e)
+        stats.busy += time.perf_counter() - start
+        stats.items += 1
+
+
+def run_pipeline(predict, tasks, write, n_jobs=1, max_pending=8, timeout=None):
+    # tasks - iterable of tasks (e.g. load_tasks(path, lazy=True)), consumed by the loader thread
+    # write(task, preds, seconds, error) - called from the writer thread for every task in order,
+    #   error is None unless predict raised or timed out (see solve_task) or killed its worker process
+    #   again when solved alone (worker_died(error))
+    # n_jobs > 1 (or None for all cores) solves in a process pool, predict must be picklable
+    # returns wall seconds and items, busy / waiting / blocked seconds and utilization of every stage,
+    # utilization = busy / (wall * workers)
+    solve = partial(solve_task, predict, timeout=timeout)
+    workers = n_jobs or os.cpu_count()
+    stats = {'load': StageStats(), 'solve': StageStats(workers), 'write': StageStats()}
+    load_queue = queue.Queue(maxsize=max_pending)
+    write_queue = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    errors = []
+    retry = RetryPool(solve)
+    loader = threading.Thread(target=load_stage, args=(tasks, load_queue, stats['load'], errors), daemon=True)
+    writer = threading.Thread(target=write_stage,
+                              args=(write, write_queue, stats['write'], stats['solve'], stop, errors, retry), daemon=True)
+    executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs != 1 else None
+    start = time.perf_counter()
+    loader.start()
+    writer.start()
+    try:
+        while not errors:
+            task = timed_get(load_queue, stats['solve'])
+            if task is DONE or errors:
+                break
+            if executor is None:
+                future = Future()
+                future.set_result(solve(task))
+            else:
+                try:
+                    future = executor.submit(solve, task)
+                except BrokenProcessPool:
+                    # unfinished tasks of the broken pool are retried in write_stage, the rest go to a new pool
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(max_workers=n_jobs)
+                    future = executor.submit(solve, task)
+            timed_put(write_queue, (task, future), stats['solve'])
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        write_queue.put(DONE)
+        writer.join()
+        retry.shutdown()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    if errors:
+        raise errors[0]
+    wall = time.perf_counter() - start
+    summary = {'wall': wall}
+    summary.update((name, stage.summary(wall)) for name, stage in stats.items())
+    return summary
+
+
+def print_pipeline_stats(summary):
+    print(f"pipeline: {summary['wall']:.2f}s")
+    for name in ('load', 'solve', 'write'):
+        stage = summary[name]
+        print(f"  {name:<6} {stage['items']:>5} items  busy {stage['busy']:8.2f}s  waiting {stage['waiting']:8.2f}s"
+              f"  blocked {stage['blocked']:8.2f}s  utilization {stage['utilization']:6.1%}")
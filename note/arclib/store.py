@@ -0,0 +1,104 @@
+# compiled task store: all grids of a dataset in one flat uint8 file read through np.memmap
+# store directory:
+#   grids.bin  - grids one after another, row-major, GRID_DTYPE
+#   index.npy  - (n_grids, 3) int64 array of grid offset, height and width
+#   tasks.json - [{'task_id': ..., 'train': [[input, output], ...], 'test': [[input, output or null], ...]}, ...]
+#                with grid numbers (rows of index.npy) instead of grids
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from arclib.dsl import Task, GRID_DTYPE, to_grid, grid_to_list
+
+
+def build_task_store(tasks, path):
+    # tasks - iterable of Task objects (e.g. load_tasks(json_path, lazy=True))
+    path = Path(path)
+    os.makedirs(path, exist_ok=True)
+    index = []
+    tasks_meta = []
+    offset = 0
+    with open(path / 'grids.bin', 'wb') as f:
+        def write_grid(grid):
+            nonlocal offset
+            grid = to_grid(grid)
+            f.write(np.ascontiguousarray(grid).tobytes())
+            index.append((offset, grid.shape[0], grid.shape[1]))
+            offset += grid.size
+            return len(index) - 1
+
+        for task in tasks:
+            test_outputs = task.test_outputs or [None] * len(task.test_inputs)
+            tasks_meta.append({
+                'task_id': task.task_id,
+                'train': [[write_grid(input_), write_grid(output)] for input_, output in zip(task.inputs, task.outputs)],
+                'test': [[write_grid(input_), None if output is None else write_grid(output)]
+                         for input_, output in zip(task.test_inputs, test_outputs)],
+            })
+    np.save(path / 'index.npy', np.array(index, dtype=np.int64).reshape(-1, 3))
+    with open(path / 'tasks.json', 'w') as f:
+        json.dump(tasks_meta, f)
+
+
+class TaskStore:
+    def __init__(self, path):
+        path = Path(path)
+        self.path = path
+        self.index = np.load(path / 'index.npy')
+        if os.path.getsize(path / 'grids.bin') > 0:
+            self.buffer = np.memmap(path / 'grids.bin', dtype=GRID_DTYPE, mode='r')
+        else:
+            self.buffer = np.zeros(0, dtype=GRID_DTYPE)
+        with open(path / 'tasks.json', 'r') as f:
+            self.tasks_meta = json.load(f)
+
+    def grid(self, i):
+        # zero-copy read-only view of grid i
+        offset, s0, s1 = self.index[i]
+        return self.buffer[offset: offset + s0 * s1].reshape(s0, s1)
+
+    def __len__(self):
+        return len(self.tasks_meta)
+
+    def __getitem__(self, idx):
+        return StoreTask(self, self.tasks_meta[idx], idx)
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+    def tasks(self):
+        return list(self)
+
+
+class StoreTask(Task):
+    # Task whose grids are views into the memory-mapped store
+    def __init__(self, store, meta, idx=None):
+        grid = store.grid
+        self.task_id = meta['task_id']
+        self.idx = idx
+        self.inputs = [grid(i) for i, o in meta['train']]
+        self.outputs = [grid(o) for i, o in meta['train']]
+        self.pairs = list(zip(self.inputs, self.outputs))
+        self.test_inputs = [grid(i) for i, o in meta['test']]
+        if meta['test'][0][1] is not None:
+            self.test_outputs = [grid(o) for i, o in meta['test']]
+            self.test_pairs = list(zip(self.test_inputs, self.test_outputs))
+        else:
+            self.test_outputs = None
+            self.test_pairs = None
+
+    @property
+    def task(self):
+        # raw json-like dict, built on demand
+        train = [{'input': grid_to_list(i), 'output': grid_to_list(o)} for i, o in self.pairs]
+        if self.test_outputs is None:
+            test = [{'input': grid_to_list(i)} for i in self.test_inputs]
+        else:
+            test = [{'input': grid_to_list(i), 'output': grid_to_list(o)} for i, o in self.test_pairs]
+        return {'train': train, 'test': test}
+
+
+def load_task_store(path):
+    return TaskStore(path)
@@ -0,0 +1,104 @@
+# ARC Prize 2024 submission.json written task by task while predictions are produced:
+# {task_id: [{'attempt_1': grid, 'attempt_2': grid}, ...one dict per test input], ...}
+# grids go straight from arrays to json, missing attempts are empty lists
+# a journal keeps the attempts of every finished task, so an interrupted run can be resumed
+import json
+import os
+
+from arclib.dsl import grid_to_list
+
+
+def get_attempts(all_input_preds, n_test, n_attempts=2):
+    # one {'attempt_1': ..., 'attempt_2': ...} dict per test input from ranked predictions of every test input
+    attempts = []
+    for i in range(n_test):
+        preds = all_input_preds[i] if i < len(all_input_preds) else []
+        attempts.append({f'attempt_{k + 1}': grid_to_list(preds[k]) if k < len(preds) else [] for k in range(n_attempts)})
+    return attempts
+
+
+class SubmissionWriter:
+    # with SubmissionWriter('submission.json') as writer:
+    #     writer.write(task.task_id, predict(task), len(task.test_inputs))
+    # every task is written (and flushed) as one line, the file is valid json once closed
+    def __init__(self, path='submission.json'):
+        self.path = path
+        self.file = open(path, 'w')
+        self.file.write('{')
+        self.n_tasks = 0
+
+    def write(self, task_id, all_input_preds, n_test):
+        self.write_attempts(task_id, get_attempts(all_input_preds, n_test))
+
+    def write_attempts(self, task_id, attempts):
+        separator = ',\n' if self.n_tasks else '\n'
+        self.file.write(separator + json.dumps(task_id) + ': ' + json.dumps(attempts, separators=(',', ':')))
+        self.file.flush()
+        self.n_tasks += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.write('\n}\n')
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_journal(path):
+    # {task_id: entry} of all complete lines, a line cut off by a crash is removed from the file
+    entries = {}
+    with open(path, 'rb') as f:
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    for line in data[:end].splitlines():
+        if line.strip():
+            entry = json.loads(line)
+            entries[entry['task_id']] = entry
+    if end < len(data):
+        os.truncate(path, end)
+    return entries
+
+
+class SubmissionJournal:
+    # append-only json lines, one per finished task: {'task_id': ..., 'attempts': [...], 'seconds': ...}
+    # every line is flushed and synced to disk before the next task starts
+    # resume=True keeps the tasks of an existing journal, they are skipped with `task_id in journal`
+    def __init__(self, path='submission_journal.jsonl', resume=False):
+        self.path = path
+        self.entries = read_journal(path) if resume and os.path.exists(path) else {}
+        self.resumed = len(self.entries)
+        self.file = open(path, 'a' if resume else 'w')
+
+    def __contains__(self, task_id):
+        return task_id in self.entries
+
+    def write(self, task_id, all_input_preds, n_test, seconds=None, durable=True):
+        # durable=False keeps the attempts for write_submission only, not on disk, so a resumed run
+        # solves the task again (e.g. after its worker process died)
+        entry = {'task_id': task_id, 'attempts': get_attempts(all_input_preds, n_test), 'seconds': seconds}
+        if durable:
+            self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.entries[task_id] = entry
+
+    def write_submission(self, path='submission.json', task_ids=None):
+        # submission file of task_ids (all journaled tasks by default) in the given order
+        if task_ids is None:
+            task_ids = list(self.entries)
+        with SubmissionWriter(path) as writer:
+            for task_id in task_ids:
+                writer.write_attempts(task_id, self.entries[task_id]['attempts'])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
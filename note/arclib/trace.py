@@ -0,0 +1,129 @@
+# solver instrumentation: call counters and timed spans, grouped by task and exported as
+# json lines (one task per line) or chrome trace (chrome://tracing, perfetto)
+# tracing is switched on by the ARCLIB_TRACE environment variable before arclib is imported,
+# otherwise traced returns functions unchanged and span returns a shared no-op context
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+import json
+import os
+import time
+
+TRACE = os.environ.get('ARCLIB_TRACE', '') not in ('', '0')
+
+
+class Tracer:
+    def __init__(self, max_events=100000):
+        # max_events - events kept per task, counters and timers are always complete
+        self.enabled = TRACE
+        self.max_events = max_events
+        self.start = time.perf_counter()
+        self.tasks = []
+        self.begin_task(None)
+
+    def begin_task(self, task_id):
+        self.current = {'task_id': task_id, 'start': time.perf_counter(), 'seconds': None,
+                        'counts': defaultdict(int), 'times': defaultdict(float), 'events': []}
+        self.tasks.append(self.current)
+
+    def end_task(self):
+        self.current['seconds'] = time.perf_counter() - self.current['start']
+        self.begin_task(None)
+
+    @contextmanager
+    def task(self, task_id):
+        self.begin_task(task_id)
+        try:
+            yield self
+        finally:
+            self.end_task()
+
+    def record(self, name, category, start, duration, args=None):
+        task = self.current
+        task['counts'][name] += 1
+        task['times'][name] += duration
+        if len(task['events']) < self.max_events:
+            task['events'].append((name, category, start, duration, args))
+
+    def count(self, name, n=1):
+        self.current['counts'][name] += n
+
+    @contextmanager
+    def span(self, name, category='solver', args=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter() - start, args)
+
+    def clear(self):
+        self.tasks = []
+        self.begin_task(None)
+
+    def finished_tasks(self):
+        # tasks with something recorded, the open task without id is left out if empty
+        return [task for task in self.tasks if task['task_id'] is not None or task['counts']]
+
+    def task_summary(self, task, events=True):
+        summary = {'task_id': task['task_id'], 'seconds': task['seconds'],
+                   'counts': dict(task['counts']), 'times': dict(task['times'])}
+        if events:
+            summary['events'] = [{'name': name, 'cat': category, 'ts': start - self.start, 'dur': duration, 'args': args}
+                                 for name, category, start, duration, args in task['events']]
+        return summary
+
+    def write_jsonl(self, path, events=True):
+        with open(path, 'w') as f:
+            for task in self.finished_tasks():
+                f.write(json.dumps(self.task_summary(task, events=events)) + '\n')
+
+    def write_chrome_trace(self, path):
+        # complete ('X') events in microseconds, one thread per task so tasks are separate rows
+        trace_events = []
+        for tid, task in enumerate(self.finished_tasks()):
+            name = str(task['task_id'])
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name}})
+            if task['seconds'] is not None:
+                trace_events.append({'name': name, 'cat': 'task', 'ph': 'X', 'pid': 1, 'tid': tid,
+                                     'ts': (task['start'] - self.start) * 1e6, 'dur': task['seconds'] * 1e6})
+            for event_name, category, start, duration, args in task['events']:
+                event = {'name': event_name, 'cat': category, 'ph': 'X', 'pid': 1, 'tid': tid,
+                         'ts': (start - self.start) * 1e6, 'dur': duration * 1e6}
+                if args:
+                    event['args'] = args
+                trace_events.append(event)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+
+tracer = Tracer()
+
+
+def traced(name=None, category='dsl'):
+    # decorator timing every call of the function, the function itself when tracing is off
+    def decorator(func):
+        if not TRACE:
+            return func
+        label = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.record(label, category, start, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+no_span = nullcontext()
+
+
+def span(name, category='solver', args=None):
+    # timed block, e.g. with span('get_object_map_funcs[0]', 'extractor'): ...
+    if not (TRACE and tracer.enabled):
+        return no_span
+    return tracer.span(name, category, args)
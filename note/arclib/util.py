@@ -1,11 +1,16 @@
-import copy
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 import json
 import os
-import pandas as pd
+import signal
+import threading
+import time
 import numpy as np
 from pathlib import Path
 
-from arclib.dsl import Task
+from arclib.dsl import Task, contains_array
+from arclib.store import build_task_store, load_task_store
 
 if os.path.exists('/kaggle'):
     data_path = Path('/kaggle/input/abstraction-and-reasoning-challenge/')
@@ -18,13 +23,13 @@ test_path = data_path / 'test'
 paths = {'train': training_path, 'eval': evaluation_path, 'test': test_path}
 
 
-def evaluate_predict_func(func):
+def evaluate_predict_func(func, n_jobs=1, chunksize=1, timeout=None):
     train_tasks = get_tasks('train')
     eval_tasks = get_tasks('eval')
     print('Evaluating train')
-    train_score, train_string = evaluate_func_on_tasks(func, train_tasks)
+    train_score, train_string = evaluate_func_on_tasks(func, train_tasks, n_jobs=n_jobs, chunksize=chunksize, timeout=timeout)
     print('Evaluating eval')
-    eval_score, eval_string = evaluate_func_on_tasks(func, eval_tasks)
+    eval_score, eval_string = evaluate_func_on_tasks(func, eval_tasks, n_jobs=n_jobs, chunksize=chunksize, timeout=timeout)
 
     print('Train score:', train_score, ';', train_string)
     print('Eval score:', eval_score, ';', eval_string)
@@ -32,12 +37,102 @@ def evaluate_predict_func(func):
     return train_score , eval_score
 
 
-def evaluate_func_on_tasks(func, tasks):
-    preds = [func(task) for task in tasks]
+def evaluate_func_on_tasks(func, tasks, n_jobs=1, chunksize=1, timeout=None, return_times=False):
+    # n_jobs > 1 (or None for all cores) solves tasks in a process pool
+    preds, times = run_func_on_tasks(func, tasks, n_jobs=n_jobs, chunksize=chunksize, timeout=timeout)
     score, string = score_predictions(tasks, preds)
+    if return_times:
+        return score, string, times
     return score, string
 
 
+class TaskTimeout(Exception):
+    pass
+
+
+def raise_task_timeout(signum, frame):
+    raise TaskTimeout()
+
+
+def solve_task(func, task, timeout=None):
+    # returns (predictions, seconds, error), error is None if func finished in time without exception
+    # timeout (seconds) needs SIGALRM, so it is ignored on Windows and outside of the main thread
+    use_alarm = timeout is not None and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        old_handler = signal.signal(signal.SIGALRM, raise_task_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    start = time.perf_counter()
+    try:
+        preds, error = func(task), None
+    except TaskTimeout:
+        preds, error = [], 'timeout'
+    except Exception as e:
+        preds, error = [], repr(e)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old_handler)
+    return preds, time.perf_counter() - start, error
+
+
+def solve_tasks(solve, tasks):
+    return [solve(task) for task in tasks]
+
+
+def run_in_process_pool(solve, tasks, n_jobs=None, chunksize=1):
+    # solve(task) results in the order of tasks, every chunk of tasks is a separate future
+    # a dead worker (os._exit, segfault, out of memory) breaks the pool and fails all unfinished chunks,
+    # their tasks are solved again one at a time in a fresh single-worker pool, so only the task that
+    # kills the worker again gets an error, other exceptions of a future become the error of its tasks
+    results = [None] * len(tasks)
+    chunks = [range(i, min(i + chunksize, len(tasks))) for i in range(0, len(tasks), chunksize)]
+    retry = []
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(solve_tasks, solve, [tasks[i] for i in chunk]) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                for i, result in zip(chunk, future.result()):
+                    results[i] = result
+            except BrokenProcessPool:
+                retry.extend(chunk)
+            except Exception as e:
+                for i in chunk:
+                    results[i] = ([], 0., repr(e))
+    executor = None
+    for i in retry:
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=1)
+        try:
+            results[i] = executor.submit(solve, tasks[i]).result()
+        except Exception as e:
+            results[i] = ([], 0., repr(e))
+            if isinstance(e, BrokenProcessPool):
+                executor.shutdown()
+                executor = None
+    if executor is not None:
+        executor.shutdown()
+    return results
+
+
+def run_func_on_tasks(func, tasks, n_jobs=1, chunksize=1, timeout=None):
+    # predictions and wall-clock seconds for every task, in the order of tasks
+    # a failed or timed out task, or one that kills its worker process, gets empty predictions
+    # and does not stop the run
+    solve = partial(solve_task, func, timeout=timeout)
+    if n_jobs == 1:
+        results = [solve(task) for task in tasks]
+    else:
+        results = run_in_process_pool(solve, tasks, n_jobs=n_jobs, chunksize=chunksize)
+    preds = []
+    times = []
+    for task, (task_preds, seconds, error) in zip(tasks, results):
+        if error is not None:
+            print('Failed:', task.idx, error)
+        preds.append(task_preds)
+        times.append(seconds)
+    return preds, times
+
+
 def score_predictions(tasks, predictions):
     n = 0
     tp = 0
@@ -70,44 +165,175 @@ def score_example_predictions(example, example_preds):
     true = output
     if type(example_preds) == np.ndarray:
         example_preds = [example_preds]
-    for pred in example_preds:
-        if pred.shape == true.shape:
-            if (pred == true).all():
-                return 1
-    return 0
+    return int(contains_array(example_preds, true))
+
+
+### Grid strings of the csv submission format: '|row|row|' with one digit per cell
+
+PIPE = ord('|')
+ZERO = ord('0')
+SPACE = ord(' ')
+
+
+def check_digits(array):
+    # one digit per cell, other values would wrap around in uint8 and corrupt the grid string
+    if array.size and (array.min() < 0 or array.max() > 9):
+        raise ValueError('grid values must be in 0..9, got ' + str(array.min()) + '..' + str(array.max()))
+
+
+def grid_bytes(array):
+    # rows as uint8 digits each followed by a pipe, after a leading pipe
+    array = np.asarray(array)
+    if array.size == 0:
+        return b'||'
+    check_digits(array)
+    buffer = np.full((array.shape[0], array.shape[1] + 1), PIPE, dtype=np.uint8)
+    buffer[:, :-1] = array + ZERO
+    return b'|' + buffer.tobytes()
+
+
+def encode_grid(array):
+    # [[1, 2], [3, 4]] -> '|12|34|'
+    return grid_bytes(array).decode('ascii')
+
+
+def encode_grids(arrays):
+    # grid strings of all arrays from one uint8 buffer: digits of all grids with pipes inserted
+    # at row ends and grid starts and spaces between grids, decoded and split in one pass
+    arrays = [np.asarray(array) for array in arrays]
+    if not arrays:
+        return []
+    if any(array.size == 0 for array in arrays):
+        return [encode_grid(array) for array in arrays]
+    heights = np.array([array.shape[0] for array in arrays])
+    widths = np.array([array.shape[1] for array in arrays])
+    sizes = heights * widths
+    grid_starts = np.cumsum(sizes) - sizes
+    digits = np.concatenate([array.ravel() for array in arrays])
+    check_digits(digits)
+    digits = digits.astype(np.uint8) + ZERO
+    row_grids = np.repeat(np.arange(len(arrays)), heights)
+    row_numbers = np.arange(len(row_grids)) - np.repeat(np.cumsum(heights) - heights, heights)
+    row_ends = grid_starts[row_grids] + (row_numbers + 1) * widths[row_grids]
+    # at equal positions: pipe closing the last row, space, pipe opening the next grid
+    positions = np.concatenate([row_ends, grid_starts[1:], grid_starts])
+    values = np.concatenate([np.full(len(row_ends), PIPE), np.full(len(arrays) - 1, SPACE),
+                             np.full(len(arrays), PIPE)]).astype(np.uint8)
+    order = np.argsort(positions, kind='stable')
+    buffer = np.insert(digits, positions[order], values[order])
+    return buffer.tobytes().decode('ascii').split(' ')
+
+
+def decode_grid(string):
+    # '|12|34|' -> array([[1, 2], [3, 4]])
+    # rows are reshaped by the position of the first inner pipe
+    rows = np.frombuffer(string.encode('ascii'), dtype=np.uint8)[1:]
+    width = np.flatnonzero(rows == PIPE)[0]
+    return (rows.reshape(-1, width + 1)[:, :width] - ZERO).astype(int)
+
+
+def decode_grids(strings):
+    # arrays of all non empty grid strings, widths are found from the pipe positions
+    # and the digits of all grids are converted in one pass over a joined uint8 buffer
+    strings = [string for string in strings if string]
+    if not strings:
+        return []
+    buffer = np.frombuffer(''.join(strings).encode('ascii'), dtype=np.uint8)
+    lengths = np.array([len(string) for string in strings])
+    starts = np.cumsum(lengths) - lengths
+    pipes = np.flatnonzero(buffer == PIPE)
+    first = np.searchsorted(pipes, starts)
+    widths = pipes[first + 1] - pipes[first] - 1
+    heights = (lengths - 1) // (widths + 1)
+    digits = (buffer[buffer != PIPE] - ZERO).astype(int)
+    grids = np.split(digits, np.cumsum(heights * widths)[:-1])
+    return [grid.reshape(height, width) for grid, height, width in zip(grids, heights.tolist(), widths.tolist())]
 
 
 def get_string(pred):
-    pred = pred.astype(int)
-    str_pred = str([list(row) for row in pred])
-    str_pred = str_pred.replace(', ', '')
-    str_pred = str_pred.replace('[[', '|')
-    str_pred = str_pred.replace('][', '|')
-    str_pred = str_pred.replace(']]', '|')
-    return str_pred
-
-
-def get_tasks(dataset='train'):
-    path = paths[dataset]
-    fns = sorted(os.listdir(path))
-    tasks = []
-    for idx, fn in enumerate(fns):
-        fp = path / fn
-        with open(fp, 'r') as f:
-            task = Task(json.load(f), idx)
-            tasks.append(task)
-    return tasks
-
-
-def submit(predict):
+    return encode_grid(pred)
+
+
+def get_tasks(dataset='train', store_path=None):
+    # store_path - compiled task store (arclib.store), built from the json files on first use
+    if store_path is None:
+        return load_tasks(paths[dataset])
+    if not os.path.exists(Path(store_path) / 'tasks.json'):
+        build_task_store(load_tasks(paths[dataset], lazy=True), store_path)
+    return load_task_store(store_path).tasks()
+
+
+def iter_json_items(fp):
+    # (key, value) pairs of a json object file, values are parsed one at a time
+    decoder = json.JSONDecoder()
+    with open(fp, 'r') as f:
+        text = f.read()
+    pos = skip_json_whitespace(text, 0)
+    if text[pos] != '{':
+        raise ValueError('Expected json object in ' + str(fp))
+    pos = skip_json_whitespace(text, pos + 1)
+    if text[pos] == '}':
+        return
+    while True:
+        key, pos = decoder.raw_decode(text, pos)
+        pos = skip_json_whitespace(text, pos)
+        if text[pos] != ':':
+            raise ValueError('Expected : at position ' + str(pos) + ' in ' + str(fp))
+        value, pos = decoder.raw_decode(text, skip_json_whitespace(text, pos + 1))
+        yield key, value
+        pos = skip_json_whitespace(text, pos)
+        if text[pos] == '}':
+            return
+        if text[pos] != ',':
+            raise ValueError('Expected , at position ' + str(pos) + ' in ' + str(fp))
+        pos = skip_json_whitespace(text, pos + 1)
+
+
+def skip_json_whitespace(text, pos):
+    while text[pos] in ' \t\n\r':
+        pos += 1
+    return pos
+
+
+def iter_task_files(path):
+    # (task_id, task) for every json file of a directory, sorted by file name
+    for fn in sorted(os.listdir(path)):
+        with open(Path(path) / fn, 'r') as f:
+            yield fn.split('.')[0], json.load(f)
+
+
+def iter_tasks(path, solutions_path=None):
+    # Task objects from a combined challenges json ({task_id: task}) or a directory with one json per task
+    # solutions_path - combined solutions json ({task_id: [test output, ...]}) added as test outputs
+    path = Path(path)
+    solutions = {}
+    if solutions_path is not None:
+        with open(solutions_path, 'r') as f:
+            solutions = json.load(f)
+    items = iter_task_files(path) if path.is_dir() else iter_json_items(path)
+    for idx, (task_id, task) in enumerate(items):
+        if task_id in solutions:
+            for example, output in zip(task['test'], solutions[task_id]):
+                example['output'] = output
+        yield Task(task, idx, task_id=task_id)
+
+
+def load_tasks(path, solutions_path=None, lazy=False):
+    # lazy=True returns a generator, so only one parsed task is held at a time
+    tasks = iter_tasks(path, solutions_path=solutions_path)
+    if lazy:
+        return tasks
+    return list(tasks)
+
+
+def submit(predict, n_jobs=1, chunksize=1, timeout=None):
+    # ARC2020 submission.csv, pandas is only needed here and imported on use
+    import pandas as pd
     submission = pd.read_csv(data_path / 'sample_submission.csv', index_col='output_id')
-    test_fns = os.listdir(test_path)
-    for fn in test_fns:
-        fp = test_path / fn
-        with open(fp, 'r') as f:
-            task = Task(json.load(f))
-        output_id = fn.split('.')[-2] + '_0'
-        preds = predict(task)
+    tasks = load_tasks(test_path)
+    all_preds, times = run_func_on_tasks(predict, tasks, n_jobs=n_jobs, chunksize=chunksize, timeout=timeout)
+    for task, preds in zip(tasks, all_preds):
+        output_id = task.task_id + '_0'
         string_preds = [get_string(pred) for pred in preds[:3]]
         pred = ' '.join(string_preds)
         submission.loc[output_id, 'output'] = pred
@@ -136,32 +362,28 @@ def arrays_equal(outputs, predicted_outputs):
 
 
 def change_inputs(task, inputs_, data='train'):
-    task_ = copy.deepcopy(task)
     if data == 'train':
-        task_.inputs = inputs_
-        task_.pairs = [(inp, out) for inp, out in zip(inputs_, task_.outputs)]
+        return task.replace(inputs=inputs_, pairs=list(zip(inputs_, task.outputs)))
     elif data == 'test':
-        task_.test_inputs = inputs_
-    return task_
+        return task.replace(test_inputs=inputs_)
+    return task.replace()
 
 
 def change_outputs(task, outputs_, data='train'):
-    task_ = copy.deepcopy(task)
     if data == 'train':
-        task_.outputs = outputs_
-        task_.pairs = [(inp, out) for inp, out in zip(task_.inputs, task_.outputs)]
+        return task.replace(outputs=outputs_, pairs=list(zip(task.inputs, outputs_)))
     elif data == 'test':
-        task_.test_outputs = outputs_
-    return task_
+        return task.replace(test_outputs=outputs_)
+    return task.replace()
 
 
 def change_inputs_outputs(task, inputs_, outputs_, data='train'):
     if data == 'train':
-        task_ = copy.deepcopy(task)
-        task_.pairs = [(inp, out) for inp, out in zip(inputs_, outputs_)]
-        task_.inputs = inputs_
-        task_.outputs = outputs_
-    return task_
+        return task.replace(inputs=inputs_, outputs=outputs_, pairs=list(zip(inputs_, outputs_)))
+    elif data == 'test':
+        test_pairs = None if outputs_ is None else list(zip(inputs_, outputs_))
+        return task.replace(test_inputs=inputs_, test_outputs=outputs_, test_pairs=test_pairs)
+    return task.replace()
 
 
 def apply_array_func(task, array_func, where='both', data='both'):
@@ -171,7 +393,7 @@ def apply_array_func(task, array_func, where='both', data='both'):
         outputs_ = [array_func(output) for output in task.outputs]
         task_ = change_inputs_outputs(task, inputs_, outputs_)
         test_inputs_ = [array_func(input_) for input_ in task.test_inputs]
-        if task.test_outputs[0]:
+        if task.test_outputs is not None:
             test_outputs_ = [array_func(output) for output in task.test_outputs]
         else:
             test_outputs_ = task.test_outputs
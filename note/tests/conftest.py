@@ -0,0 +1,5 @@
+# arclib is imported from the note directory, as in the starter notebooks
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
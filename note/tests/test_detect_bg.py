@@ -0,0 +1,53 @@
+# detect_bg_ against the original implementation: one labeling pass per candidate color,
+# the last color (most common first) with an object touching 3 sides wins
+import numpy as np
+import pytest
+from skimage.measure import label
+
+from arclib.bench import make_grid_corpus
+from arclib.cache import grid_cache
+from arclib.dsl import detect_bg_
+from arclib.util import load_tasks, training_path
+
+
+def reference_detect_bg(array):
+    bg = 0
+    colors = set(array.ravel().tolist())
+    values, counts = np.unique(array, return_counts=True)
+    most_common_color = values[np.argmax(counts)]
+    for color in [most_common_color] + list(colors - {most_common_color}):
+        label_array, n = label((array == color).astype(int), connectivity=2, background=0, return_num=True)
+        for i in range(1, n + 1):
+            object_map = label_array == i
+            sums = [np.count_nonzero(object_map[0, 1:-1]), np.count_nonzero(object_map[-1, 1:-1]),
+                    np.count_nonzero(object_map[1:-1, 0]), np.count_nonzero(object_map[1:-1, -1])]
+            if sum(s > 0 for s in sums) >= 3:
+                bg = color
+                break
+    return bg
+
+
+def assert_agrees(grids):
+    grid_cache.clear()
+    mismatches = [i for i, grid in enumerate(grids) if detect_bg_(grid) != reference_detect_bg(grid)]
+    assert mismatches == []
+
+
+def test_generated_grids():
+    assert_agrees(make_grid_corpus(3000, seed=0))
+
+
+def test_small_and_degenerate_grids():
+    rng = np.random.default_rng(1)
+    grids = [rng.integers(0, n_colors, size=rng.integers(1, 6, size=2)) for n_colors in (1, 2, 3, 10) for _ in range(300)]
+    grids += [np.zeros((1, 1), dtype=int), np.full((30, 30), 7), np.eye(5, dtype=int), np.arange(12).reshape(3, 4) % 10]
+    assert_agrees(grids)
+
+
+def test_arc_training_grids():
+    if not training_path.exists():
+        pytest.skip('ARC training data not found at ' + str(training_path))
+    grids = []
+    for task in load_tasks(training_path, lazy=True):
+        grids.extend(task.inputs + task.outputs + task.test_inputs)
+    assert_agrees(grids)
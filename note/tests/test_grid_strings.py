@@ -0,0 +1,78 @@
+# grid string codec against the original string based encoder and parser of the csv submission format
+import numpy as np
+import pytest
+
+from arclib.util import encode_grid, encode_grids, decode_grid, decode_grids, get_string
+
+
+def reference_encode(grid):
+    # original get_string on python ints
+    string = str(np.asarray(grid).astype(int).tolist())
+    string = string.replace(', ', '')
+    string = string.replace('[[', '|')
+    string = string.replace('][', '|')
+    string = string.replace(']]', '|')
+    return string
+
+
+def reference_convert_to_csv_format(matrix):
+    # original starter encoder of sample submission attempts
+    return '|' + '|'.join(''.join(map(str, row)) for row in matrix) + '|'
+
+
+def reference_decode(string):
+    # original translate_submission parser
+    return [list(map(int, line)) for line in string.split('|')[1:-1]]
+
+
+def random_grids(seed=0, n=500):
+    rng = np.random.default_rng(seed)
+    grids = [rng.integers(0, 10, size=rng.integers(1, 31, size=2)) for _ in range(n)]
+    grids += [rng.integers(0, 10, size=(1, w)) for w in range(1, 31)]
+    grids += [rng.integers(0, 10, size=(h, 1)) for h in range(1, 31)]
+    grids += [np.zeros((1, 1), dtype=int), np.full((30, 30), 9), rng.integers(0, 10, size=(5, 7)).astype(np.uint8)]
+    return grids
+
+
+def test_encode_grid():
+    for grid in random_grids():
+        expected = reference_encode(grid)
+        assert encode_grid(grid) == expected
+        assert encode_grid(grid.tolist()) == expected
+        assert get_string(grid) == expected
+        assert reference_convert_to_csv_format(grid.tolist()) == expected
+
+
+def test_decode_grid():
+    for grid in random_grids(seed=1):
+        string = reference_encode(grid)
+        decoded = decode_grid(string)
+        assert decoded.tolist() == reference_decode(string) == grid.tolist()
+
+
+def test_batch_round_trip():
+    grids = random_grids(seed=2)
+    strings = encode_grids(grids)
+    assert strings == [reference_encode(grid) for grid in grids]
+    assert [grid.tolist() for grid in decode_grids(strings)] == [reference_decode(string) for string in strings]
+    for n in (1, 2, 3):
+        assert encode_grids(grids[:n]) == strings[:n]
+        assert [grid.tolist() for grid in decode_grids(strings[:n])] == [grid.tolist() for grid in grids[:n]]
+
+
+def test_empty_attempts():
+    assert encode_grid([]) == reference_convert_to_csv_format([]) == '||'
+    assert decode_grid('||').tolist() == reference_decode('||')
+    assert encode_grids([]) == []
+    assert decode_grids([]) == []
+    assert decode_grids(['', '']) == []
+    assert encode_grids([[[1, 2]], [], [[3], [4]]]) == ['|12|', '||', '|3|4|']
+    assert [grid.tolist() for grid in decode_grids(['|12|', '', '||', '|3|4|'])] == [[[1, 2]], [[]], [[3], [4]]]
+
+
+@pytest.mark.parametrize('grid', [[[10, 1]], [[-1, 0]], np.array([[255]], dtype=np.uint8)])
+def test_out_of_range_values(grid):
+    with pytest.raises(ValueError):
+        encode_grid(grid)
+    with pytest.raises(ValueError):
+        encode_grids([[[1]], grid])
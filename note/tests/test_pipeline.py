@@ -0,0 +1,36 @@
+# run_pipeline writes every task in order, a dead worker only costs the task that kills it
+import os
+import time
+
+from arclib.pipeline import run_pipeline, worker_died
+
+
+def predict(task):
+    time.sleep(0.01)
+    if task in (3, 25):
+        os._exit(1)
+    if task == 7:
+        raise ValueError('bad')
+    return [[task]]
+
+
+def run(n_tasks, n_jobs):
+    written = []
+    run_pipeline(predict, range(n_tasks), lambda *result: written.append(result), n_jobs=n_jobs, max_pending=4)
+    return written
+
+
+def test_dead_worker():
+    for n_jobs, n_tasks in ((3, 12), (2, 40)):
+        written = run(n_tasks, n_jobs)
+        assert [task for task, *_ in written] == list(range(n_tasks))
+        failed = {task: error for task, preds, seconds, error in written if error is not None}
+        assert sorted(failed) == [task for task in (3, 7, 25) if task < n_tasks]
+        assert worker_died(failed[3]) and not worker_died(failed[7])
+        assert all(preds == [[task]] for task, preds, seconds, error in written if task not in failed)
+
+
+def test_in_process():
+    written = run(3, 1)
+    assert [(task, preds, error) for task, preds, seconds, error in written] == [(0, [[0]], None), (1, [[1]], None),
+                                                                                 (2, [[2]], None)]
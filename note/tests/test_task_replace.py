@@ -0,0 +1,39 @@
+# derived tasks of Task.replace share grids with their source but cannot change it in place
+import numpy as np
+import pytest
+
+from arclib.dsl import Task
+from arclib.util import apply_array_func, change_inputs
+
+TASK = {'train': [{'input': [[1, 0], [0, 2]], 'output': [[2, 0], [0, 1]]},
+                  {'input': [[3, 3]], 'output': [[4, 4]]}],
+        'test': [{'input': [[5, 0]], 'output': [[0, 5]]}]}
+
+
+def test_derived_task_is_immutable():
+    task = Task(TASK)
+    derived = apply_array_func(task, np.fliplr, 'inputs')
+    with pytest.raises(AttributeError):
+        derived.inputs.append(task.inputs[0])
+    with pytest.raises(ValueError):
+        derived.inputs[0][0, 0] = 5
+    with pytest.raises(ValueError):
+        derived.outputs[0][0, 0] = 5
+    # the source task keeps its own writable lists and grids, the view shares their memory
+    assert all(grid.flags.writeable for grid in task.inputs + task.outputs + task.test_inputs)
+    assert np.shares_memory(derived.outputs[0], task.outputs[0])
+    task.inputs.append(task.inputs[0])
+    assert len(derived.inputs) == 2
+    task.outputs[0][0, 0] = 5
+    assert derived.outputs[0][0, 0] == 5
+    assert [grid.tolist() for grid in derived.inputs] == [[[0, 1], [2, 0]], [[3, 3]]]
+
+
+def test_derived_task_fields():
+    task = Task(TASK)
+    derived = change_inputs(task, [np.rot90(grid) for grid in task.inputs])
+    assert [(i.tolist(), o.tolist()) for i, o in derived.pairs] == [(np.rot90(i).tolist(), o.tolist()) for i, o in task.pairs]
+    assert np.shares_memory(derived.test_pairs[0][0], task.test_pairs[0][0])
+    assert task.inputs[0].flags.writeable and task.pairs[0][1].flags.writeable
+    assert derived.task is task.task
+    assert type(derived) is Task